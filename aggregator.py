@@ -0,0 +1,125 @@
+import contextvars
+import logging
+import queue
+import threading
+
+from calculator import calculate_collateral
+
+# Виды сообщений очереди
+_BATCH = "batch"
+_FINISH = "finish"
+_STOP = "stop"
+
+
+class StreamAggregator:
+    """
+    Потоковая сборка объявлений запроса. Парсеры кладут пачки объявлений в ограниченную очередь
+    (put блокируется, если агрегатор не успевает — обратное давление), а единственный поток
+    агрегатора по порядку отсеивает повторы, применяет квоты сайтов, пишет в хранилище,
+    обновляет текущую оценку и вызывает on_progress. Общий список под блокировкой не нужен:
+    в listings пишет только поток агрегатора.
+    """
+
+    def __init__(self, limit, stop_event, dedupe=None, scheduler=None, store=None, stopper=None,
+                 on_progress=None, maxsize=64):
+        self.limit = limit
+        self.stop_event = stop_event
+        self.dedupe = dedupe  # DedupeIndex
+        self.scheduler = scheduler  # QuotaScheduler
+        self.store = store  # RunWriter
+        self.stopper = stopper  # AdaptiveStop
+        self.on_progress = on_progress  # Вызывается после каждой пачки с текущим progress()
+        self.listings = []
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.batches = 0
+        self._price_sum = 0
+        self._by_source = {}
+        self._thread = None
+
+    def start(self):
+        # Контекст (query_id журнала) переносится в поток агрегатора
+        self._thread = threading.Thread(target=contextvars.copy_context().run, args=(self._run,),
+                                        name="aggregator", daemon=True)
+        self._thread.start()
+        return self
+
+    def put(self, source, page, listings, record=True):
+        """Пачка объявлений страницы от парсера (record=False — не из выдачи этого запуска)"""
+        self.queue.put((_BATCH, source, page, listings, record))
+
+    def finish(self, source):
+        """Сайт закончил работу; обрабатывается после всех его пачек"""
+        self.queue.put((_FINISH, source, None, None, None))
+
+    def close(self):
+        """Дожидается обработки всех пачек"""
+        if self._thread is None:
+            return
+        self.queue.put((_STOP, None, None, None, None))
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        while True:
+            kind, source, page, listings, record = self.queue.get()
+            if kind == _STOP:
+                break
+            try:
+                if kind == _FINISH:
+                    if self.scheduler is not None:
+                        self.scheduler.finish(source)
+                else:
+                    self._process(source, page, listings, record)
+            except Exception as e:
+                logging.error(f"Ошибка обработки пачки объявлений {source}: {e}")
+
+    def _process(self, source, page, listings, record):
+        # В индекс повторов попадают только принятые квотой объявления: отклонённое квотой
+        # не должно отсеять свою копию, пришедшую позже с другого сайта
+        take = (lambda fresh: self.scheduler.take(source, fresh)) if self.scheduler is not None else None
+        if self.dedupe is not None:
+            merged = self.dedupe.merged
+            unique = self.dedupe.add_many(listings, take)
+            if self.dedupe.merged > merged:
+                logging.info(f"{source}, страница {page}: {self.dedupe.merged - merged} объявлений уже найдены на этом или другом сайте")
+        else:
+            unique = take(listings) if take is not None else listings
+
+        self.listings.extend(unique)
+        if record and self.store is not None:
+            self.store.add(unique)
+        self.batches += 1
+        self._price_sum += sum(listing.price for listing in unique)
+        self._by_source[source] = self._by_source.get(source, 0) + len(unique)
+        logging.info(f"{source}, страница {page}: добавлено {len(unique)} цен. Всего: {len(self.listings)}")
+
+        # Цены страницы учитываются в оценке и тогда, когда сбор остановит лимит
+        precise = self.stopper is not None and self.stopper.add([listing.price for listing in unique])
+        if len(self.listings) >= self.limit:  # Проверяем общий лимит
+            self.stop_event.set()  # Устанавливаем флаг остановки
+            if self.stopper is not None:
+                self.stopper.limit_reached()
+            logging.info(f"Достигнут лимит в {len(self.listings)} цен. Завершаю парсинг.")
+        elif precise:
+            self.stop_event.set()
+            logging.info(f"Оценка достаточно точна на {len(self.listings)} ценах. Завершаю парсинг.")
+
+        if self.on_progress is not None:
+            self.on_progress(self.progress())
+
+    def partial_result(self):
+        """Оценка по уже собранным ценам (не больше лимита) — доступна во время парсинга"""
+        prices = [listing.price for listing in self.listings[:self.limit]]
+        return calculate_collateral(prices)
+
+    def progress(self):
+        count = len(self.listings)
+        return {
+            "prices": count,
+            "limit": self.limit,
+            "running_average": round(self._price_sum / count) if count else 0,
+            "by_source": dict(self._by_source),
+            "batches": self.batches,
+            "queue_depth": self.queue.qsize(),
+            "partial": self.partial_result(),
+        }
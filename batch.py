@@ -0,0 +1,145 @@
+import csv
+import json
+import logging
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+
+def parse_year(value):
+    """Год или диапазон годов: 2020, [2019, 2021], "2020", "2019-2021", "2019 2021" -> список int"""
+    if value is None or value == "":
+        return None
+    if isinstance(value, int):
+        return [value]
+    if isinstance(value, list):
+        return [int(v) for v in value]
+    parts = str(value).replace("-", " ").replace(",", " ").split()
+    return [int(part) for part in parts]
+
+
+def _job_from_row(row):
+    """Задание из строки файла; ValueError, если строка некорректна"""
+    if not isinstance(row, dict):
+        raise ValueError("строка не является объектом")
+    make = str(row.get("make") or "").strip()
+    model = str(row.get("model") or "").strip()
+    if not make or not model:
+        raise ValueError("не указаны марка или модель")
+    try:
+        year = parse_year(row.get("year"))
+    except (TypeError, ValueError):
+        raise ValueError(f"некорректный год: {row.get('year')!r}")
+    limit = row.get("limit")
+    if isinstance(limit, str):
+        limit = limit.strip()
+    try:
+        # Лимит не указан — None, его выбирает run_batch; явный 0 дойдёт до проверки и задание не выполнится
+        limit = None if limit is None or limit == "" else int(limit)
+    except (TypeError, ValueError):
+        raise ValueError(f"некорректный лимит: {row.get('limit')!r}")
+    return {"make": make, "model": model, "year": year, "limit": limit}
+
+
+def load_jobs(path):
+    """
+    Читает задания из JSONL (объект на строку) или CSV с колонками make, model, year, limit.
+    Некорректная строка не прерывает пакет: она становится заданием с полем error
+    и попадает в сводку как неуспешное.
+    """
+    with open(path, "r", encoding="utf-8-sig") as f:
+        if path.lower().endswith(".csv"):
+            rows = [(number, row) for number, row in enumerate(csv.DictReader(f), 2)]
+        else:
+            rows = [(number, line) for number, line in enumerate(f, 1)
+                    if line.strip() and not line.lstrip().startswith("#")]
+
+    jobs = []
+    for number, row in rows:
+        try:
+            if isinstance(row, str):
+                row = json.loads(row)
+            jobs.append(_job_from_row(row))
+        except ValueError as e:
+            raw = row if isinstance(row, dict) else {}
+            jobs.append({"make": raw.get("make"), "model": raw.get("model"), "year": raw.get("year"),
+                         "limit": raw.get("limit"), "error": f"строка {number}: {e}"})
+    return jobs
+
+
+def run_batch(path, run_query, resolve_limit=None, workers=2, output=None, summary=None):
+    """
+    Пакетная оценка: задания выполняются параллельно (workers штук одновременно) на общих
+    браузерах, прокси и кэше. Результат каждого задания пишется отдельной строкой JSON
+    сразу по готовности, в конце сохраняется сводка со временем и ошибками по заданиям.
+    resolve_limit(лимит задания или None) -> (лимит, текст ошибки или None) — тот же выбор
+    лимита, что и для одиночной оценки; без него задание без лимита собирает 100 цен.
+    """
+    jobs = load_jobs(path)
+    logging.info(f"Пакетная оценка: {len(jobs)} заданий из {path}, одновременно {workers}")
+
+    out = open(output, "a", encoding="utf-8") if output else sys.stdout
+    out_lock = threading.Lock()
+    started = time.monotonic()
+    report = []
+
+    def run_job(index, job):
+        job_start = time.monotonic()
+        entry = {"index": index, **job}
+        try:
+            if job.get("error"):
+                raise ValueError(job["error"])
+            if resolve_limit is not None:
+                limit, error = resolve_limit(job["limit"])
+            else:
+                limit, error = (100 if job["limit"] is None else job["limit"]), None
+            if error:
+                raise ValueError(error)
+            entry["limit"] = limit
+            result = run_query(job["make"], job["model"], job["year"], limit)
+            entry.update(status="ok", result=result)
+        except Exception as e:
+            logging.error(f"Задание {index} ({job['make']} {job['model']}) завершилось ошибкой: {e}")
+            entry.update(status="error", error=str(e))
+        entry["duration_sec"] = round(time.monotonic() - job_start, 2)
+
+        # Строка результата выводится сразу, не дожидаясь остальных заданий
+        with out_lock:
+            out.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            out.flush()
+        return entry
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch") as executor:
+            futures = [executor.submit(run_job, index, job) for index, job in enumerate(jobs)]
+            for future in as_completed(futures):
+                report.append(future.result())
+    finally:
+        if output:
+            out.close()
+
+    report.sort(key=lambda entry: entry["index"])
+    failed = [entry for entry in report if entry["status"] != "ok"]
+    durations = [entry["duration_sec"] for entry in report]
+    summary_data = {
+        "jobs_file": path,
+        "total": len(report),
+        "succeeded": len(report) - len(failed),
+        "failed": len(failed),
+        "duration_sec": round(time.monotonic() - started, 2),
+        "avg_query_sec": round(sum(durations) / len(durations), 2) if durations else 0,
+        "max_query_sec": max(durations) if durations else 0,
+        "queries": [
+            {key: entry.get(key) for key in ("index", "make", "model", "year", "limit", "status", "duration_sec", "error")}
+            for entry in report
+        ],
+    }
+
+    summary = summary or f"data/batch_{datetime.now().strftime('%d-%m-%Y__%H-%M')}_summary.json"
+    with open(summary, "w", encoding="utf-8") as f:
+        json.dump(summary_data, f, indent=4, ensure_ascii=False)
+    logging.info(f"Пакет завершён: успешно {summary_data['succeeded']}, с ошибками {summary_data['failed']}. "
+                 f"Сводка: {summary}")
+    return summary_data
@@ -0,0 +1,148 @@
+"""
+Сквозной нагрузочный прогон оценок на сервере воспроизведения (без обращения к сайтам):
+пропускная способность и хвосты задержек при разном числе одновременных оценок.
+
+    python -m bench.bench_e2e --archive data/archive --make lada --model granta --concurrency 1 2 4
+    python -m bench.bench_e2e --archive data/archive --make lada --model granta --latency 0.3 --jitter 0.5 --rate-429 0.05
+    python -m bench.bench_e2e ... --http   # страницы auto.ru и drom.ru через HTTP, без браузеров
+
+Архив записывается обычным запуском с --record (см. bench/replay_server.py).
+"""
+import argparse
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import main
+import rate_limiter
+from bench.replay_server import ReplayServer, percentile
+from driver_pool import get_driver_pool
+from metrics import get_metrics
+from page_cache import get_page_cache
+from parsers import AutoRuParser, DromParser
+from site_archive import set_replay_base
+from utils import safe_request
+
+
+class HttpFetchMixin:
+    """Загрузка страницы выдачи обычным HTTP-запросом вместо браузера"""
+
+    def _fetch(self, page, url):
+        response = safe_request(url, use_proxy=False, retries=1)
+        return response.text if response is not None and response.status_code == 200 else None
+
+
+class HttpAutoRuParser(HttpFetchMixin, AutoRuParser):
+    pass
+
+
+class HttpDromParser(HttpFetchMixin, DromParser):
+    pass
+
+
+def run_level(server, concurrency, queries, make, model, year, limit, parallel_pages):
+    """Прогон queries оценок, не больше concurrency одновременно; сводка уровня"""
+    metrics = get_metrics()
+    metrics.reset()
+    server.reset()
+    durations = []
+    results = []
+
+    def query():
+        start = time.perf_counter()
+        result = main.run_query(make, model, year, limit, use_proxy=False, save=False, parallel_pages=parallel_pages)
+        durations.append(time.perf_counter() - start)
+        return result
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(query) for _ in range(queries)]:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                logging.error(f"Оценка не выполнена: {e}")
+    wall = time.perf_counter() - start
+
+    served = server.stats()
+    durations.sort()
+    stages = metrics.snapshot()["stages"]
+    return {
+        "concurrency": concurrency,
+        "queries": len(results),
+        "failed": queries - len(results),
+        "wall_sec": round(wall, 2),
+        "queries_per_min": round(len(results) / wall * 60, 1),
+        "pages_per_sec": round(served["served"] / wall, 2),
+        "prices": sum(result["cars_parsed"] for result in results),
+        "query_p50_sec": round(percentile(durations, 0.5), 2) if durations else None,
+        "query_p95_sec": round(percentile(durations, 0.95), 2) if durations else None,
+        "query_max_sec": round(durations[-1], 2) if durations else None,
+        "fetch": stages.get("fetch", {}),
+        "rate_limit_wait": stages.get("rate_limit_wait", {}),
+        "server": served,
+    }
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description="Сквозной прогон оценок на сервере воспроизведения")
+    parser.add_argument("--archive", required=True, help="Папка архива (main.py --record)")
+    parser.add_argument("--make", required=True)
+    parser.add_argument("--model", required=True)
+    parser.add_argument("--year", nargs='+', type=int)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--queries", type=int, default=4, help="Оценок на каждом уровне параллельности")
+    parser.add_argument("--concurrency", nargs='+', type=int, default=[1, 2, 4],
+                        help="Сколько оценок выполнять одновременно (несколько значений — несколько прогонов)")
+    parser.add_argument("--parallel-pages", type=int, default=2)
+    parser.add_argument("--latency", type=float, default=0.2, help="Задержка ответа сервера, сек")
+    parser.add_argument("--jitter", type=float, default=0.2, help="Случайная добавка к задержке, до стольких сек")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="Доля ответов 429")
+    parser.add_argument("--captcha-rate", type=float, default=0.0, help="Доля страниц капчи")
+    parser.add_argument("--start-rate", type=float, default=5.0,
+                        help="Начальная частота запросов к сайту, запр/сек (у сервера нет настоящих лимитов)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--http", action="store_true", help="auto.ru и drom.ru через HTTP-запросы, без браузеров")
+    parser.add_argument("--output", help="Куда сохранить отчёт (JSON)")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+    get_page_cache().enabled = False  # Каждая оценка загружает страницы заново
+    rate_limiter.START_RATE = {True: args.start_rate, False: args.start_rate}
+    rate_limiter.DOMAIN_START_RATE = {}
+    rate_limiter.MAX_RATE = max(rate_limiter.MAX_RATE, args.start_rate * 2)
+
+    server = ReplayServer(args.archive, args.latency, args.jitter, args.rate_429, args.captcha_rate, seed=args.seed)
+    set_replay_base(server.start())
+    driver_pool = get_driver_pool()
+    if args.http:
+        main.AutoRuParser, main.DromParser = HttpAutoRuParser, HttpDromParser
+    else:
+        driver_pool.use_proxy = False
+        driver_pool.size = max(args.concurrency) * 2 * max(args.parallel_pages, 1)
+        driver_pool.start()
+
+    report = []
+    try:
+        for concurrency in args.concurrency:
+            level = run_level(server, concurrency, args.queries, args.make, args.model, args.year, args.limit,
+                              args.parallel_pages)
+            report.append(level)
+            print(f"{concurrency} одновременно: {level['queries_per_min']} оценок/мин, {level['pages_per_sec']} стр/сек, "
+                  f"p50 {level['query_p50_sec']} сек, p95 {level['query_p95_sec']} сек, "
+                  f"429: {level['server']['429']}, капч: {level['server']['captcha']}")
+    finally:
+        server.stop()
+        driver_pool.shutdown()
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main_bench()
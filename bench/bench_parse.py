@@ -0,0 +1,234 @@
+"""
+Бенчмарк разбора страниц на сохранённых фикстурах (без сети и браузера).
+
+    python -m bench.bench_parse                  # отчёт по всем сайтам и движкам
+    python -m bench.bench_parse --save-baseline  # сохранить результат как базовую линию
+    python -m bench.bench_parse --check          # сравнить с базовой линией, код возврата 1 при регрессии
+
+Страницы в fixtures/state — выдача со встроенным состоянием (JSON) рядом с обычной разметкой:
+на них движок "state" должен разобрать состояние и совпасть с разбором DOM.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+from parsers.extractors import DOM_ENGINE, ENGINES, SITES, get_extractor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURES_DIR = os.path.join(BENCH_DIR, "fixtures")
+STATE_FIXTURES_DIR = os.path.join(FIXTURES_DIR, "state")
+BASELINE_FILE = os.path.join(BENCH_DIR, "baseline.json")
+
+# Папка фикстур для каждого сайта
+SITE_DIRS = {"auto.ru": "auto_ru", "drom.ru": "drom_ru", "avito.ru": "avito_ru"}
+
+
+def load_fixtures(fixtures_dir=FIXTURES_DIR):
+    """Загружает сохранённые страницы: {сайт: [html, ...]}"""
+    fixtures = {}
+    for site, dirname in SITE_DIRS.items():
+        site_dir = os.path.join(fixtures_dir, dirname)
+        if not os.path.isdir(site_dir):
+            continue
+        pages = []
+        for name in sorted(os.listdir(site_dir)):
+            if name.endswith(".html"):
+                with open(os.path.join(site_dir, name), "r", encoding="utf-8") as f:
+                    pages.append(f.read())
+        if pages:
+            fixtures[site] = pages
+    return fixtures
+
+
+def bench_engine(site, pages, engine, repeat):
+    """Скорость и пиковая память разбора страниц сайта одним движком"""
+    extractor = get_extractor(site, engine)
+    extractor.extract(pages[0])  # Прогрев
+
+    listings = 0
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for html in pages:
+            listings += len(extractor.extract(html)[0])
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    for html in pages:
+        extractor.extract(html)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    total_pages = len(pages) * repeat
+    return {
+        "pages_per_sec": round(total_pages / elapsed, 2),
+        "listings_per_sec": round(listings / elapsed, 2),
+        "ms_per_page": round(elapsed / total_pages * 1000, 3),
+        "peak_memory_kb": round(peak / 1024, 1),
+    }
+
+
+def _selectors(spec):
+    """Селекторы сайта: (название, селектор, применяется к объявлению или ко всей странице)"""
+    selectors = [("items", spec.items, False), ("title", spec.title, True)]
+    if spec.year:
+        selectors.append(("year", spec.year, True))
+    selectors += [(f"price[{i}]", selector, True) for i, selector in enumerate(spec.prices)]
+    selectors.append(("link", spec.link, True))
+    selectors.append(("mileage", spec.mileage, True))
+    if spec.city:
+        selectors.append(("city", spec.city, True))
+    selectors.append(("next_page", spec.next_page, False))
+    return selectors
+
+
+def selector_costs(site, pages, engine, repeat):
+    """Время каждого селектора в мс на страницу (без учёта построения дерева)"""
+    spec = SITES[site]
+    if engine == "state":
+        engine = DOM_ENGINE  # Селекторы "state" — это его запасной путь по DOM
+    if engine == "lxml":
+        import lxml.html
+        from lxml.cssselect import CSSSelector
+        parser = lxml.html.HTMLParser(encoding="utf-8")
+        roots = [lxml.html.fromstring(html.encode("utf-8"), parser=parser) for html in pages]
+        item_selector = CSSSelector(spec.items)
+        compile_selector = CSSSelector
+        select_all = lambda selector, node: selector(node)
+        select_one = lambda selector, node: selector(node)
+    else:
+        from bs4 import BeautifulSoup
+        roots = [BeautifulSoup(html, "html.parser") for html in pages]
+        item_selector = spec.items
+        compile_selector = lambda selector: selector
+        select_all = lambda selector, node: node.select(selector)
+        select_one = lambda selector, node: node.select_one(selector)
+
+    items = [select_all(item_selector, root) for root in roots]
+    costs = {}
+    for name, selector, per_item in _selectors(spec):
+        compiled = compile_selector(selector)
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for root, page_items in zip(roots, items):
+                if per_item:
+                    for item in page_items:
+                        select_one(compiled, item)
+                else:
+                    select_all(compiled, root)
+        costs[name] = round((time.perf_counter() - start) / (repeat * len(roots)) * 1000, 4)
+    return costs
+
+
+def check_consistency(site, pages):
+    """Сверяет результаты всех движков с эталонным BeautifulSoup; возвращает список расхождений"""
+    reference = get_extractor(site, "bs4")
+    mismatches = []
+    for engine in ENGINES:
+        if engine == "bs4":
+            continue
+        extractor = get_extractor(site, engine)
+        for number, html in enumerate(pages, 1):
+            if extractor.extract(html) != reference.extract(html):
+                mismatches.append(f"{site}: страница {number}, движок {engine} расходится с bs4")
+    return mismatches
+
+
+def check_state(state_dir=STATE_FIXTURES_DIR):
+    """Сверяет разбор встроенного состояния с разбором DOM; возвращает список расхождений"""
+    mismatches = []
+    for site, dirname in SITE_DIRS.items():
+        path = os.path.join(state_dir, f"{dirname}.html")
+        if not os.path.exists(path):
+            continue
+        with open(path, "r", encoding="utf-8") as f:
+            html = f.read()
+        extractor = get_extractor(site, "state")
+        from_state = extractor.from_state
+        result = extractor.extract(html)
+        if extractor.from_state == from_state:
+            mismatches.append(f"{site}: состояние на {dirname}.html не разобрано, движок state ушёл в DOM")
+        elif result != get_extractor(site, DOM_ENGINE).extract(html):
+            mismatches.append(f"{site}: состояние на {dirname}.html расходится с разбором DOM ({DOM_ENGINE})")
+    return mismatches
+
+
+def run(engines, repeat):
+    fixtures = load_fixtures()
+    results = {}
+    mismatches = check_state()
+    for site, pages in fixtures.items():
+        mismatches += check_consistency(site, pages)
+        for engine in engines:
+            result = bench_engine(site, pages, engine, repeat)
+            result["selectors_ms"] = selector_costs(site, pages, engine, repeat)
+            results[f"{site}/{engine}"] = result
+    return results, mismatches
+
+
+def compare(results, baseline, max_regression):
+    """Регрессии pages/sec относительно базовой линии больше max_regression (доля)"""
+    regressions = []
+    for key, result in results.items():
+        base = baseline.get(key)
+        if not base:
+            continue
+        floor = base["pages_per_sec"] * (1 - max_regression)
+        if result["pages_per_sec"] < floor:
+            regressions.append(
+                f"{key}: {result['pages_per_sec']} стр/сек против {base['pages_per_sec']} в базовой линии")
+    return regressions
+
+
+def print_report(results):
+    print(f"{'сайт/движок':<16} {'стр/сек':>10} {'объявл/сек':>12} {'мс/стр':>9} {'пик, КБ':>10}")
+    for key, result in results.items():
+        print(f"{key:<16} {result['pages_per_sec']:>10} {result['listings_per_sec']:>12} "
+              f"{result['ms_per_page']:>9} {result['peak_memory_kb']:>10}")
+        selectors = ", ".join(f"{name}={cost}" for name, cost in result["selectors_ms"].items())
+        print(f"{'':<16} селекторы, мс/стр: {selectors}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк разбора страниц на фикстурах")
+    parser.add_argument("--engine", choices=sorted(ENGINES), action="append", help="Движок (по умолчанию все)")
+    parser.add_argument("--repeat", type=int, default=20, help="Сколько раз разбирать корпус")
+    parser.add_argument("--save-baseline", action="store_true", help="Сохранить результат как базовую линию")
+    parser.add_argument("--check", action="store_true", help="Сравнить с базовой линией")
+    parser.add_argument("--max-regression", type=float, default=0.25, help="Допустимое падение стр/сек (доля)")
+    parser.add_argument("--json", action="store_true", help="Вывести результат в JSON")
+    args = parser.parse_args(argv)
+
+    results, mismatches = run(args.engine or sorted(ENGINES), args.repeat)
+    if args.json:
+        print(json.dumps(results, indent=4, ensure_ascii=False))
+    else:
+        print_report(results)
+
+    for mismatch in mismatches:
+        print(f"РАСХОЖДЕНИЕ: {mismatch}")
+
+    if args.save_baseline:
+        with open(BASELINE_FILE, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=4, ensure_ascii=False)
+        print(f"Базовая линия сохранена: {BASELINE_FILE}")
+
+    failed = bool(mismatches)
+    if args.check:
+        try:
+            with open(BASELINE_FILE, "r", encoding="utf-8") as f:
+                baseline = json.load(f)
+        except FileNotFoundError:
+            print(f"Базовая линия не найдена: {BASELINE_FILE}")
+            return 1
+        regressions = compare(results, baseline, args.max_regression)
+        for regression in regressions:
+            print(f"РЕГРЕССИЯ: {regression}")
+        failed = failed or bool(regressions)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,80 @@
+"""
+Симуляция деления лимита между сайтами (quota.QuotaScheduler) без сети: быстрый и медленный сайт
+с разным выходом страницы. Проверяет, что медленный сайт получает свою долю, а не остатки.
+
+    python -m bench.bench_quota                      # сводка по сценариям
+    python -m bench.bench_quota --check              # код возврата 1, если сайт недополучил долю
+"""
+import argparse
+import heapq
+import json
+import sys
+
+from quota import QuotaScheduler
+
+# Сценарии: лимит, режим и сайты (сек. на страницу, объявлений на странице, страниц в выдаче)
+SCENARIOS = {
+    "yield_fast_first": (60, "yield", {"auto.ru": (1.0, 37, 20), "drom.ru": (3.0, 20, 20)}),
+    "yield_limit_100": (100, "yield", {"auto.ru": (1.0, 37, 20), "drom.ru": (3.0, 20, 20)}),
+    "static_fast_first": (60, "static", {"auto.ru": (1.0, 37, 20), "drom.ru": (3.0, 20, 20)}),
+    "slow_runs_out": (100, "yield", {"auto.ru": (1.0, 37, 20), "drom.ru": (3.0, 20, 1)}),
+}
+
+MIN_SHARE = 0.5  # Сайт с выдачей должен получить хотя бы такую часть своей доли по весу
+
+
+def simulate(limit, mode, sites):
+    """Прогон сценария; {сайт: собрано}"""
+    scheduler = QuotaScheduler(limit, list(sites), mode=mode)
+    pages_left = {site: pages for site, (_, _, pages) in sites.items()}
+    events = [(period, site) for site, (period, _, _) in sites.items()]
+    heapq.heapify(events)
+    waiting = set()
+    while events and not scheduler.done:
+        now, site = heapq.heappop(events)
+        if not scheduler.has_quota(site):
+            waiting.add(site)  # Ждёт квоты, пока не изменится распределение
+            continue
+        period, per_page, _ = sites[site]
+        scheduler.take(site, [None] * per_page)
+        pages_left[site] -= 1
+        if pages_left[site] <= 0:
+            scheduler.finish(site)
+        else:
+            heapq.heappush(events, (now + period, site))
+        for other in waiting:
+            heapq.heappush(events, (now + sites[other][0], other))
+        waiting.clear()
+    return dict(scheduler.collected)
+
+
+def check(name, limit, sites, collected):
+    """Недополучившие долю сайты (с выдачей больше их доли)"""
+    problems = []
+    fair = limit / len(sites)
+    for site, (_, per_page, pages) in sites.items():
+        available = per_page * pages
+        expected = min(fair, available) * MIN_SHARE
+        if collected[site] < expected:
+            problems.append(f"{name}: {site} собрал {collected[site]} из {limit}, ожидалось не меньше {expected:.0f}")
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Симуляция деления лимита между сайтами")
+    parser.add_argument("--check", action="store_true", help="Код возврата 1, если сайт недополучил долю")
+    args = parser.parse_args(argv)
+
+    report, problems = {}, []
+    for name, (limit, mode, sites) in SCENARIOS.items():
+        collected = simulate(limit, mode, sites)
+        report[name] = collected
+        problems += check(name, limit, sites, collected)
+    print(json.dumps(report, indent=4, ensure_ascii=False))
+    for problem in problems:
+        print(f"НЕДОПОЛУЧЕНО: {problem}")
+    return 1 if args.check and problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
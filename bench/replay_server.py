@@ -0,0 +1,165 @@
+"""
+Локальный сервер, который вместо сайтов отдаёт страницы из архива (site_archive.py) —
+для офлайн-прогонов и нагрузочных замеров без обращения к настоящим сайтам.
+
+    python main.py --make lada --model granta --record data/archive     # записать архив
+    python -m bench.replay_server --archive data/archive --port 8800 --latency 0.3 --jitter 0.2 --rate-429 0.05
+    python main.py --make lada --model granta --replay http://127.0.0.1:8800 --cache-ttl 0
+
+Адрес страницы на сервере: /<хост сайта>/<путь>?<параметры> (см. site_archive.replay_url).
+"""
+import argparse
+import json
+import logging
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from page_cache import normalize_url
+from site_archive import SiteArchive, original_url
+
+CAPTCHA_PAGE = ("<html><head><title>Ой!</title></head><body><form action=\"/showcaptcha\">"
+                "<div class=\"captcha\">Подтвердите, что запросы отправляли вы, а не робот</div></form></body></html>")
+
+
+def percentile(values, q):
+    """Квантиль q (0..1) по отсортированному списку значений"""
+    if not values:
+        return None
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+class ReplayServer:
+    """
+    Отдаёт страницы архива с искусственной задержкой latency + случайная добавка до jitter сек.,
+    с долей rate_429 ответов 429 (Retry-After: retry_after) и долей captcha_rate страниц капчи (403).
+    """
+
+    def __init__(self, archive_dir, latency=0.0, jitter=0.0, rate_429=0.0, captcha_rate=0.0, retry_after=1,
+                 seed=None):
+        self.archive = SiteArchive(archive_dir)
+        self.pages = self.archive.load()
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.captcha_rate = captcha_rate
+        self.retry_after = retry_after
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+        self.counts = {"served": 0, "not_found": 0, "429": 0, "captcha": 0}
+        self.latencies = []  # Время ответов сервера, сек
+
+    def _roll(self):
+        """(задержка, исход) очередного запроса: "page", "429" или "captcha" """
+        with self._lock:
+            delay = self.latency + self._random.uniform(0, self.jitter)
+            roll = self._random.random()
+        if roll < self.rate_429:
+            return delay, "429"
+        if roll < self.rate_429 + self.captcha_rate:
+            return delay, "captcha"
+        return delay, "page"
+
+    def respond(self, path):
+        """(статус, заголовки, тело) для пути запроса"""
+        start = time.perf_counter()
+        delay, outcome = self._roll()
+        time.sleep(delay)
+        entry = self.pages.get(normalize_url(original_url(path)))
+        if outcome == "429":
+            status, headers, body = 429, {"Retry-After": str(self.retry_after)}, "Too Many Requests"
+        elif outcome == "captcha":
+            status, headers, body = 403, {"Content-Type": "text/html; charset=utf-8"}, CAPTCHA_PAGE
+        elif entry is None:
+            outcome = "not_found"
+            status, headers, body = 404, {}, "Not Found"
+        else:
+            outcome = "served"
+            status, headers, body = 200, dict(entry["headers"]), self.archive.body(entry)
+            headers.setdefault("Content-Type", "text/html; charset=utf-8")
+        with self._lock:
+            self.counts[outcome] += 1
+            self.latencies.append(time.perf_counter() - start)
+        return status, headers, body
+
+    def start(self, host="127.0.0.1", port=0):
+        """Запускает сервер в фоновом потоке; возвращает его адрес"""
+        replay = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive, как у настоящих сайтов
+
+            def do_GET(self):
+                status, headers, body = replay.respond(self.path)
+                data = body.encode("utf-8")
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                logging.debug(f"replay {self.address_string()} {format % args}")
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="replay-server", daemon=True).start()
+        address = f"http://{host}:{self._server.server_port}"
+        logging.info(f"Сервер воспроизведения {address}: {len(self.pages)} страниц из {self.archive.archive_dir}")
+        return address
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def reset(self):
+        """Обнуляет счётчики (между прогонами)"""
+        with self._lock:
+            self.counts = dict.fromkeys(self.counts, 0)
+            self.latencies = []
+
+    def stats(self):
+        with self._lock:
+            latencies = sorted(self.latencies)
+            counts = dict(self.counts)
+        counts["requests"] = len(latencies)
+        for name, q in (("p50_sec", 0.5), ("p95_sec", 0.95), ("p99_sec", 0.99)):
+            value = percentile(latencies, q)
+            counts[name] = round(value, 4) if value is not None else None
+        return counts
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    parser = argparse.ArgumentParser(description="Сервер воспроизведения архива страниц")
+    parser.add_argument("--archive", required=True, help="Папка архива (main.py --record)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8800)
+    parser.add_argument("--latency", type=float, default=0.0, help="Задержка ответа, сек")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Случайная добавка к задержке, до стольких сек")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="Доля ответов 429")
+    parser.add_argument("--captcha-rate", type=float, default=0.0, help="Доля страниц капчи (403)")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After ответов 429, сек")
+    parser.add_argument("--seed", type=int, help="Зерно случайных задержек и отказов")
+    args = parser.parse_args()
+
+    server = ReplayServer(args.archive, args.latency, args.jitter, args.rate_429, args.captcha_rate,
+                          args.retry_after, args.seed)
+    server.start(args.host, args.port)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        print(json.dumps(server.stats(), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
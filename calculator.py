@@ -1,15 +1,161 @@
-def calculate_collateral(prices):
-    if not prices:
-        return {
-            "average_price": 0,
-            "collateral_value": 0,
-            "cars_parsed": 0
-        }
+import warnings
+from statistics import NormalDist
+
+import numpy as np
+
+COLLATERAL_RATE = 0.8  # Залоговая стоимость = средняя цена * 0.8
+MAD_THRESHOLD = 3.5  # Цены дальше 3.5 MAD от медианы считаются выбросами
+MAD_SCALE = 1.4826  # MAD -> стандартное отклонение для нормального распределения
+MEAN_AD_SCALE = 1.2533  # То же для среднего абсолютного отклонения
+TRIM = 0.1  # Доля цен, отбрасываемых с каждого края для усечённого среднего
+QUANTILES = {"p10": 0.1, "p25": 0.25, "p75": 0.75, "p90": 0.9}
+
 
-    average_price = sum(prices) / len(prices)
-    collateral_value = average_price * 0.8
+def _empty_result():
     return {
-        "average_price": round(average_price),  # Целые числа для рублей
-        "collateral_value": round(collateral_value),
-        "cars_parsed": len(prices)
-    }
\ No newline at end of file
+        "average_price": 0,
+        "collateral_value": 0,
+        "cars_parsed": 0,
+        "median_price": 0,
+        "trimmed_mean_price": 0,
+        "price_quantiles": {name: 0 for name in QUANTILES},
+        "outliers_rejected": 0,
+    }
+
+
+def _to_matrix(price_lists):
+    """Списки цен разной длины -> матрица, дополненная NaN"""
+    width = max(len(prices) for prices in price_lists)
+    matrix = np.full((len(price_lists), width), np.nan)
+    for row, prices in enumerate(price_lists):
+        matrix[row, :len(prices)] = prices
+    return matrix
+
+
+def _outlier_mask(matrix):
+    """Маска цен без выбросов по MAD для каждой строки матрицы (NaN — пусто); возвращает (present, median, keep)"""
+    present = ~np.isnan(matrix)
+    median = np.nanmedian(matrix, axis=1)
+    deviation = np.abs(matrix - median[:, None])
+    mad = np.nanmedian(deviation, axis=1) * MAD_SCALE
+    # При MAD == 0 (больше половины цен одинаковые) берём среднее абсолютное отклонение,
+    # а если и оно 0 (все цены равны) — выбросов нет
+    mad = np.where(mad > 0, mad, np.nanmean(deviation, axis=1) * MEAN_AD_SCALE)
+    limit = np.where(mad > 0, mad * MAD_THRESHOLD, np.inf)
+    keep = present & (deviation <= limit[:, None])
+    return present, median, keep
+
+
+def _robust_stats(matrix, keep=None):
+    """
+    Статистики по каждой строке матрицы цен (NaN — пусто) за один векторный проход:
+    выбросы по MAD, среднее и усечённое среднее без выбросов, медиана и квантили.
+    keep — готовая маска цен без выбросов (тогда выбросы заново не ищутся).
+    """
+    if keep is None:
+        present, median, keep = _outlier_mask(matrix)
+    else:
+        present, median = ~np.isnan(matrix), np.nanmedian(matrix, axis=1)
+    counts = present.sum(axis=1)
+    kept_counts = keep.sum(axis=1)
+    kept = np.where(keep, matrix, np.nan)
+
+    with np.errstate(invalid="ignore", divide="ignore"):  # Группа, целиком из выбросов, — NaN
+        mean = np.nansum(kept, axis=1) / kept_counts
+
+    # Усечённое среднее: NaN при сортировке уходят в конец строки
+    ordered = np.sort(kept, axis=1)
+    cumulative = np.concatenate([np.zeros((len(matrix), 1)), np.cumsum(np.nan_to_num(ordered), axis=1)], axis=1)
+    trim = np.floor(kept_counts * TRIM).astype(int)
+    rows = np.arange(len(matrix))
+    trimmed_sum = cumulative[rows, kept_counts - trim] - cumulative[rows, trim]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        trimmed_mean = trimmed_sum / (kept_counts - 2 * trim)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # All-NaN строка
+        quantiles = np.nanquantile(kept, list(QUANTILES.values()), axis=1)
+    return counts, kept_counts, mean, median, trimmed_mean, quantiles
+
+
+def _round(value):
+    return round(value) if np.isfinite(value) else 0
+
+
+def calculate_collateral_batch(price_lists, keep_lists=None):
+    """
+    Оценка сразу для многих запросов: список списков цен -> список результатов calculate_collateral.
+    keep_lists (параллельно price_lists) — уже найденные цены без выбросов, вместо поиска по каждому списку.
+    """
+    results = [_empty_result() for _ in price_lists]
+    filled = [index for index, prices in enumerate(price_lists) if len(prices)]
+    if not filled:
+        return results
+
+    matrix = _to_matrix([price_lists[index] for index in filled])
+    keep = None
+    if keep_lists is not None:
+        keep = _to_matrix([keep_lists[index] for index in filled]) == 1
+    counts, kept_counts, mean, median, trimmed_mean, quantiles = _robust_stats(matrix, keep)
+    for row, index in enumerate(filled):
+        results[index] = {
+            "average_price": _round(mean[row]),  # Целые числа для рублей
+            "collateral_value": _round(mean[row] * COLLATERAL_RATE),
+            "cars_parsed": int(counts[row]),
+            "median_price": _round(median[row]),
+            "trimmed_mean_price": _round(trimmed_mean[row]),
+            "price_quantiles": {name: _round(quantiles[i, row]) for i, name in enumerate(QUANTILES)},
+            "outliers_rejected": int(counts[row] - kept_counts[row]),
+        }
+    return results
+
+
+def confidence_interval(prices, confidence=0.95):
+    """
+    Средняя цена без выбросов и её доверительный интервал (нормальное приближение):
+    (mean, low, high, число цен без выбросов). При одной цене интервал бесконечен.
+    """
+    if not len(prices):
+        return 0, -np.inf, np.inf, 0
+    matrix = np.asarray(prices, dtype=float)[None, :]
+    _, _, keep = _outlier_mask(matrix)
+    kept = matrix[keep]
+    mean = kept.mean()
+    if len(kept) < 2:
+        return mean, -np.inf, np.inf, len(kept)
+    half_width = NormalDist().inv_cdf((1 + confidence) / 2) * kept.std(ddof=1) / np.sqrt(len(kept))
+    return mean, mean - half_width, mean + half_width, len(kept)
+
+
+def _breakdown(prices, keep, keys):
+    """
+    Оценка по группам (год, сайт) одной пачкой. Выбросы не ищутся заново внутри групп:
+    используется общая маска keep, поэтому разбивка согласована с общей оценкой.
+    """
+    groups = {}
+    for price, kept, key in zip(prices, keep, keys):
+        group = groups.setdefault(key, ([], []))
+        group[0].append(price)
+        group[1].append(kept)
+    names = sorted(groups, key=str)
+    results = calculate_collateral_batch([groups[n][0] for n in names], [groups[n][1] for n in names])
+    return {str(name): result for name, result in zip(names, results)}
+
+
+def calculate_collateral(prices, years=None, sources=None):
+    """
+    Средняя цена без выбросов (MAD), залоговая стоимость, медиана, усечённое среднее и квантили.
+    years/sources (параллельно prices) добавляют разбивку по годам и сайтам.
+    """
+    if not len(prices):
+        result = _empty_result()
+        keep = []
+    else:
+        _, _, keep = _outlier_mask(np.asarray(prices, dtype=float)[None, :])
+        keep = keep[0]
+        result = calculate_collateral_batch([prices], [keep])[0]
+    if years is not None:
+        result["by_year"] = _breakdown(prices, keep, years)
+    if sources is not None:
+        result["by_source"] = _breakdown(prices, keep, sources)
+    return result
@@ -0,0 +1,81 @@
+import threading
+
+
+def _city_key(city):
+    return city.strip().lower().replace("ё", "е") if city else None
+
+
+class DedupeIndex:
+    """
+    Индекс для отсева повторов среди объявлений всех сайтов, проверка одного объявления — O(1).
+    Повтор — то же объявление того же сайта (сдвиг выдачи между страницами) или машина,
+    выставленная на нескольких сайтах: совпадают год, цена и пробег, а город, если указан
+    в обоих объявлениях, тоже совпадает.
+    """
+
+    def __init__(self):
+        self._ids = set()  # (source, listing_id)
+        self._cars = {}  # (year, price, mileage) -> город первого объявления
+        self._lock = threading.Lock()
+        self.merged = 0  # Сколько повторов отброшено всего
+        self.merged_by_source = {}  # Повторы по сайтам, на которых они встретились
+
+    @staticmethod
+    def car_key(listing):
+        """Отпечаток машины; без года, цены или пробега объявления между сайтами не сопоставляются"""
+        if not (listing.year and listing.price and listing.mileage):
+            return None
+        return listing.year, listing.price, listing.mileage
+
+    def _is_duplicate(self, listing, batch_ids, batch_cars):
+        """Повтор ли объявление среди записанных в индекс и уже просмотренных в этой пачке"""
+        if listing.listing_id:
+            listing_key = (listing.source, listing.listing_id)
+            if listing_key in self._ids or listing_key in batch_ids:
+                return True
+            batch_ids.add(listing_key)
+
+        car_key = self.car_key(listing)
+        if car_key is None:
+            return False
+        city = _city_key(listing.city)
+        known = self._cars if car_key in self._cars else batch_cars
+        if car_key not in known:
+            batch_cars[car_key] = city
+            return False
+        known_city = known[car_key]
+        if city and known_city and city != known_city:
+            return False  # Такие же год, цена и пробег, но в другом городе — другая машина
+        return True
+
+    def _remember(self, listing):
+        if listing.listing_id:
+            self._ids.add((listing.source, listing.listing_id))
+        car_key = self.car_key(listing)
+        if car_key is not None:
+            self._cars.setdefault(car_key, _city_key(listing.city))
+
+    def add_many(self, listings, accept=None):
+        """
+        Возвращает объявления, которых ещё не было в индексе, и запоминает их.
+        accept(новые) -> принятые (например, квота сайта): в индекс записываются только принятые,
+        чтобы отклонённое объявление не отсеяло его копию с другого сайта.
+        """
+        unique = []
+        with self._lock:
+            batch_ids, batch_cars = set(), {}
+            for listing in listings:
+                if self._is_duplicate(listing, batch_ids, batch_cars):
+                    self.merged += 1
+                    self.merged_by_source[listing.source] = self.merged_by_source.get(listing.source, 0) + 1
+                else:
+                    unique.append(listing)
+            if accept is not None:
+                unique = accept(unique)
+            for listing in unique:
+                self._remember(listing)
+        return unique
+
+    def stats(self):
+        with self._lock:
+            return {"merged": self.merged, "merged_by_source": dict(self.merged_by_source)}
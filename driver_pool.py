@@ -0,0 +1,588 @@
+import json
+import logging
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+from urllib.parse import urlparse
+
+from metrics import get_metrics
+from proxy_pool import get_proxy_pool, proxy_to_url
+
+try:
+    import psutil  # Необязательная зависимость: контроль памяти браузера
+except ImportError:
+    psutil = None
+
+CHROME_VERSION_MAIN = 135
+
+# Скачанные и пропатченные undetected_chromedriver драйверы, по одному на версию Chrome
+DRIVER_CACHE_DIR = os.path.join("cache", "chromedriver")
+_driver_cache_lock = threading.Lock()
+
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+
+
+# Ресурсы, не нужные для разбора выдачи: картинки, видео, шрифты, стили, реклама и счётчики.
+# Шаблоны Network.setBlockedURLs сопоставляются со всем адресом (* — любая подстрока), поэтому
+# расширения привязаны к концу пути (*.css, *.css?*), а хосты — к хосту и его поддоменам
+BLOCKED_EXTENSIONS = ("png", "jpg", "jpeg", "gif", "webp", "avif", "svg", "ico", "mp4", "webm", "m3u8", "mp3",
+                      "woff", "woff2", "ttf", "otf", "eot", "css")
+BLOCKED_HOSTS = (
+    "avatars.mds.yandex.net",  # Фото объявлений auto.ru (адреса без расширения)
+    "mc.yandex.ru", "an.yandex.ru", "adfox.ru", "doubleclick.net", "google-analytics.com", "googletagmanager.com",
+    "googlesyndication.com", "top-fwz1.mail.ru", "tns-counter.ru", "criteo.com", "criteo.net", "scorecardresearch.com",
+)
+BLOCKED_URL_PATTERNS = (
+    [f"*.{extension}" for extension in BLOCKED_EXTENSIONS]
+    + [f"*.{extension}?*" for extension in BLOCKED_EXTENSIONS]
+    + [f"*://{host}/*" for host in BLOCKED_HOSTS]
+    + [f"*://*.{host}/*" for host in BLOCKED_HOSTS]
+    + ["*://yandex.ru/ads/*", "*://vk.com/rtrg*"]
+)
+
+
+def build_chrome_options(user_data_dir, proxy=None, lean=True):
+    """
+    Настройки Chrome, общие для всех парсеров. lean — облегчённая загрузка: страница
+    считается загруженной по DOMContentLoaded (eager), лишние ресурсы блокируются (enable_lean_load).
+    """
+    import undetected_chromedriver as uc  # Тяжёлый импорт (selenium) — только когда нужен браузер
+    options = uc.ChromeOptions()
+    options.add_argument("--headless=new")
+    options.add_argument("--no-sandbox")
+    options.add_argument("--disable-dev-shm-usage")
+    options.add_argument("--disable-gpu")
+    options.add_argument("--ignore-certificate-errors")
+    options.add_argument("--disable-blink-features=AutomationControlled")
+    options.add_argument(f"--user-data-dir={user_data_dir}")
+    options.add_argument(f"--user-agent={USER_AGENT}")
+    if proxy:
+        options.add_argument(f"--proxy-server={proxy_to_url(proxy)}")
+    if lean:
+        options.page_load_strategy = "eager"
+    # Журнал DevTools — для учёта трафика страниц (PageLoadStats)
+    options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+    return options
+
+
+def enable_lean_load(driver, enabled=True):
+    """Включает (или снимает) блокировку ресурсов из BLOCKED_URL_PATTERNS через DevTools; False — не удалось"""
+    try:
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": BLOCKED_URL_PATTERNS if enabled else []})
+        return True
+    except Exception as e:
+        logging.warning(f"Не удалось включить блокировку ресурсов: {e}")
+        return False
+
+
+def page_traffic(driver):
+    """
+    Трафик браузера с прошлого вызова по журналу DevTools: (байт получено, запросов, заблокировано)
+    или None, если журнал недоступен.
+    """
+    try:
+        entries = driver.get_log("performance")
+    except Exception:
+        return None
+    received = requests = blocked = 0
+    for entry in entries:
+        try:
+            message = json.loads(entry["message"])["message"]
+        except (KeyError, ValueError):
+            continue
+        method = message.get("method")
+        if method == "Network.loadingFinished":
+            received += message["params"].get("encodedDataLength", 0)
+            requests += 1
+        elif method == "Network.loadingFailed":
+            if message["params"].get("blockedReason"):
+                blocked += 1
+            else:
+                requests += 1
+    return received, requests, blocked
+
+
+class PageLoadStats:
+    """
+    Трафик загрузок страниц по сайтам с блокировкой ресурсов и без неё. Экономия на странице —
+    разница средних объёмов страниц сайта в обоих режимах (полностью грузятся контрольные
+    страницы облегчённых браузеров и все страницы с --full-load).
+    """
+
+    def __init__(self):
+        self._totals = {}  # (сайт, lean) -> [страниц, байт, запросов, заблокировано, секунд]
+        self._lock = threading.Lock()
+
+    def add(self, site, lean, traffic, seconds):
+        received, requests, blocked = traffic
+        with self._lock:
+            totals = self._totals.setdefault((site, lean), [0, 0, 0, 0, 0.0])
+            for i, value in enumerate((1, received, requests, blocked, seconds)):
+                totals[i] += value
+
+    def _average(self, site, lean):
+        totals = self._totals.get((site, lean))
+        if not totals:
+            return None
+        pages, received, requests, blocked, seconds = totals
+        return {"pages": pages, "avg_bytes": round(received / pages), "avg_requests": round(requests / pages, 1),
+                "avg_blocked": round(blocked / pages, 1), "avg_seconds": round(seconds / pages, 2)}
+
+    def saved_per_page(self, site):
+        """(байт, запросов) экономии на странице сайта или None без замеров полного режима"""
+        with self._lock:
+            lean, full = self._average(site, True), self._average(site, False)
+        if not lean or not full:
+            return None
+        return full["avg_bytes"] - lean["avg_bytes"], full["avg_requests"] - lean["avg_requests"]
+
+    def report(self):
+        with self._lock:
+            sites = sorted({site for site, _ in self._totals})
+            report = {site: {"lean": self._average(site, True), "full": self._average(site, False)} for site in sites}
+        for site in sites:
+            saved = self.saved_per_page(site)
+            if saved is not None:
+                report[site]["saved_bytes_per_page"], report[site]["saved_requests_per_page"] = saved
+        return report
+
+
+class PooledDriver:
+    """Браузер из пула вместе с папкой профиля и счётчиками"""
+
+    def __init__(self, driver, user_data_dir, proxy, use_proxy, lean=False):
+        self.driver = driver
+        self.lean = lean  # Браузер облегчённый: eager и блокировка лишних ресурсов
+        self.blocking = lean  # Блокировка включена для текущей страницы
+        self.user_data_dir = user_data_dir
+        self.proxy = proxy
+        self.use_proxy = use_proxy
+        self.pages = 0
+        self.created_at = time.monotonic()
+        self.baseline_memory = None
+
+    def memory_mb(self):
+        """Суммарная память процессов браузера (МБ) или None, если psutil недоступен"""
+        if psutil is None:
+            return None
+        try:
+            # undetected_chromedriver запускает Chrome отдельно от chromedriver
+            pid = getattr(self.driver, "browser_pid", None)
+            if not pid:
+                process = getattr(getattr(self.driver, "service", None), "process", None)
+                pid = process.pid if process else None
+            if not pid:
+                return None
+            process = psutil.Process(pid)
+            processes = [process] + process.children(recursive=True)
+            return sum(p.memory_info().rss for p in processes) / (1024 * 1024)
+        except Exception:
+            return None
+
+    def is_alive(self):
+        """Проверка здоровья: браузер отвечает на простой скрипт"""
+        try:
+            return self.driver.execute_script("return 1") == 1
+        except Exception:
+            return False
+
+    def quit(self):
+        try:
+            self.driver.quit()
+        except Exception as e:
+            logging.warning(f"Ошибка при закрытии драйвера: {e}")
+        shutil.rmtree(self.user_data_dir, ignore_errors=True)
+
+
+def cached_driver_path(version_main=CHROME_VERSION_MAIN):
+    """
+    Путь к пропатченному chromedriver для версии Chrome. Драйвер скачивается и патчится
+    один раз и хранится в DRIVER_CACHE_DIR; браузеры запускаются с готовым файлом
+    (undetected_chromedriver не патчит уже пропатченный драйвер). None — скачать не удалось.
+    """
+    path = os.path.join(DRIVER_CACHE_DIR, f"chromedriver_{version_main}" + (".exe" if os.name == "nt" else ""))
+    if os.path.exists(path):
+        return path
+    with _driver_cache_lock:
+        if os.path.exists(path):
+            return path
+        try:
+            from undetected_chromedriver.patcher import Patcher
+            start = time.monotonic()
+            patcher = Patcher(version_main=version_main)
+            patcher.auto()
+            os.makedirs(DRIVER_CACHE_DIR, exist_ok=True)
+            temporary = f"{path}.{os.getpid()}.tmp"
+            shutil.copy2(patcher.executable_path, temporary)
+            os.replace(temporary, path)  # Атомарно: другие процессы не увидят недописанный файл
+            logging.info(f"chromedriver {version_main} скачан и сохранён в кэш за {time.monotonic() - start:.2f} сек.")
+            return path
+        except Exception as e:
+            logging.warning(f"Не удалось подготовить chromedriver {version_main} для кэша: {e}")
+            return None
+
+
+def create_driver(use_proxy=True, lean=True):
+    """Запускает новый браузер (undetected_chromedriver с откатом на стандартный Selenium)"""
+    import undetected_chromedriver as uc
+    user_data_dir = tempfile.mkdtemp()
+    with get_metrics().timer("proxy_select"):
+        proxy = get_proxy_pool().get() if use_proxy else None
+    options = build_chrome_options(user_data_dir, proxy, lean)
+    driver_path = cached_driver_path()
+
+    try:
+        driver = uc.Chrome(
+            options=options,
+            version_main=CHROME_VERSION_MAIN,
+            driver_executable_path=driver_path  # Готовый драйвер из кэша вместо скачивания при каждом запуске
+        )
+    except Exception as e:
+        logging.warning(f"Ошибка undetected_chromedriver: {e}, пробуем стандартный Selenium")
+        try:
+            from selenium import webdriver
+            from selenium.webdriver.chrome.service import Service
+            driver = webdriver.Chrome(options=options, service=Service(driver_path) if driver_path else None)
+        except Exception as e:
+            logging.error(f"Ошибка инициализации WebDriver: {e}")
+            shutil.rmtree(user_data_dir, ignore_errors=True)
+            raise
+
+    return PooledDriver(driver, user_data_dir, proxy, use_proxy, lean and enable_lean_load(driver))
+
+
+class DriverPool:
+    """
+    Пул заранее запущенных браузеров. Парсеры берут драйвер в аренду (acquire) и возвращают (release).
+    Драйвер перезапускается после max_pages страниц, при росте памяти больше max_memory_growth раз
+    (или выше max_memory_mb) и при падении.
+    """
+
+    def __init__(self, size=2, max_pages=50, max_memory_mb=1500, max_memory_growth=3.0, use_proxy=True, lean=True):
+        self.size = size
+        self.lean = lean  # Облегчённая загрузка страниц новыми браузерами
+        self.baseline_every = 20  # Каждая такая страница облегчённого браузера грузится полностью — для замера экономии
+        self.load_stats = PageLoadStats()
+        self.max_pages = max_pages
+        self.max_memory_mb = max_memory_mb
+        self.max_memory_growth = max_memory_growth
+        self.use_proxy = use_proxy  # Режим, в котором браузеры прогреваются заранее
+        self._idle = {True: [], False: []}
+        self._leased = {}  # id(driver) -> PooledDriver
+        self._launching = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        if psutil is None:
+            logging.warning("psutil не установлен — перезапуск браузеров по памяти отключён (pip install psutil)")
+
+    def start(self):
+        """Прогревает браузеры до размера пула в фоновых потоках"""
+        with self._cond:
+            missing = self.size - self._total() - self._launching
+            self._launching += max(missing, 0)
+        for _ in range(max(missing, 0)):
+            threading.Thread(target=self._launch, args=(self.use_proxy,), name="driver-launch", daemon=True).start()
+
+    def _total(self):
+        return len(self._idle[True]) + len(self._idle[False]) + len(self._leased)
+
+    def _launch(self, use_proxy):
+        """Запускает браузер и кладёт его в список свободных"""
+        pooled = None
+        try:
+            start = time.monotonic()
+            pooled = create_driver(use_proxy, self.lean)
+            pooled.baseline_memory = pooled.memory_mb()
+            get_metrics().observe("driver_launch", time.monotonic() - start)
+            logging.info(f"Браузер для пула запущен за {time.monotonic() - start:.2f} сек.")
+        except Exception as e:
+            logging.error(f"Не удалось запустить браузер для пула: {e}")
+        with self._cond:
+            closed = self._closed
+            if pooled is not None and not closed:
+                self._idle[use_proxy].append(pooled)
+        if pooled is not None and closed:
+            pooled.quit()  # Пул закрыли, пока браузер запускался
+        with self._cond:
+            self._launching -= 1  # Только после закрытия: shutdown ждёт, пока запусков не останется
+            self._cond.notify_all()
+        return pooled is not None
+
+    def acquire(self, use_proxy=None, timeout=120):
+        """Выдаёт здоровый драйвер из пула; при необходимости запускает новый"""
+        use_proxy = self.use_proxy if use_proxy is None else use_proxy
+        deadline = time.monotonic() + timeout
+        while True:
+            pooled = victim = None
+            with self._cond:
+                if self._closed:
+                    raise RuntimeError("Пул браузеров закрыт")
+                if self._idle[use_proxy]:
+                    pooled = self._idle[use_proxy].pop()
+                elif self._total() + self._launching < self.size:
+                    self._launching += 1
+                elif self._idle[not use_proxy]:
+                    # Пул заполнен свободными браузерами другого режима — освобождаем место
+                    victim = self._idle[not use_proxy].pop()
+                    self._launching += 1
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError("Нет свободных браузеров в пуле")
+                    self._cond.wait(remaining)
+                    continue
+
+            if pooled is None:
+                if victim is not None:
+                    victim.quit()
+                if not self._launch(use_proxy):
+                    raise RuntimeError("Не удалось запустить браузер")
+                continue
+
+            if pooled.is_alive():
+                with self._cond:
+                    self._leased[id(pooled.driver)] = pooled
+                return pooled.driver
+
+            logging.warning("Браузер из пула не отвечает — заменяем")
+            pooled.quit()
+
+    def proxy_for(self, driver):
+        """Прокси, с которым запущен арендованный браузер (None — собственный IP)"""
+        with self._cond:
+            pooled = self._leased.get(id(driver))
+            return pooled.proxy if pooled is not None else None
+
+    def note_page(self, driver):
+        """Учитывает загруженную страницу для последующего перезапуска браузера"""
+        with self._cond:
+            pooled = self._leased.get(id(driver))
+            if pooled is not None:
+                pooled.pages += 1
+
+    def prepare_page(self, driver):
+        """Перед загрузкой страницы: снимает блокировку ресурсов на контрольную страницу и возвращает после неё"""
+        with self._cond:
+            pooled = self._leased.get(id(driver))
+        if pooled is None or not pooled.lean:
+            return
+        blocking = not self.baseline_every or (pooled.pages + 1) % self.baseline_every != 0
+        if blocking != pooled.blocking and enable_lean_load(driver, blocking):
+            pooled.blocking = blocking
+        page_traffic(driver)  # Трафик до загрузки страницы к ней не относится
+
+    def finish_load(self, driver, timeout=30):
+        """
+        После driver.get: контрольная страница облегчённого браузера дожидается события load,
+        как при обычной (normal) стратегии загрузки, — чтобы сравнение шло с прежним поведением.
+        """
+        with self._cond:
+            pooled = self._leased.get(id(driver))
+        if pooled is None or not pooled.lean or pooled.blocking:
+            return
+        deadline = time.monotonic() + timeout
+        try:
+            while driver.execute_script("return document.readyState") != "complete" and time.monotonic() < deadline:
+                time.sleep(0.05)
+        except Exception as e:
+            logging.debug(f"Не удалось дождаться полной загрузки контрольной страницы: {e}")
+
+    def record_page(self, driver, url, seconds):
+        """Учитывает трафик загруженной страницы и пишет его в журнал"""
+        with self._cond:
+            pooled = self._leased.get(id(driver))
+        traffic = page_traffic(driver)
+        if pooled is None or traffic is None:
+            return
+        site = urlparse(url).netloc.removeprefix("www.")
+        self.load_stats.add(site, pooled.blocking, traffic, seconds)
+        received, requests, blocked = traffic
+        message = f"Страница {url}: {received / 1024:.0f} КБ, запросов {requests}, заблокировано {blocked}"
+        saved = self.load_stats.saved_per_page(site) if pooled.blocking else None
+        if saved is not None:
+            message += f", экономия ~{saved[0] / 1024:.0f} КБ и {saved[1]:.0f} запросов"
+        logging.info(message)
+
+    def _needs_recycle(self, pooled):
+        if pooled.pages >= self.max_pages:
+            logging.info(f"Браузер отработал {pooled.pages} страниц — перезапуск")
+            return True
+        memory = pooled.memory_mb()
+        if memory is not None:
+            if memory > self.max_memory_mb or (
+                    pooled.baseline_memory and memory > pooled.baseline_memory * self.max_memory_growth):
+                logging.info(f"Браузер занимает {memory:.0f} МБ — перезапуск")
+                return True
+        return not pooled.is_alive()
+
+    def release(self, driver, broken=False, use_proxy=None):
+        """
+        Возвращает драйвер в пул; сломанный или отработавший своё заменяется новым в фоне —
+        в режиме use_proxy (по умолчанию в режиме возвращённого), если следом понадобится другой.
+        """
+        if driver is None:
+            return
+        with self._cond:
+            pooled = self._leased.pop(id(driver), None)
+        if pooled is None:
+            logging.debug("Возвращён драйвер не из пула — пропускаем")
+            return
+
+        if broken or self._closed or self._needs_recycle(pooled):
+            pooled.quit()
+            with self._cond:
+                if self._closed:
+                    self._cond.notify_all()
+                    return
+                self._launching += 1
+            relaunch_proxy = pooled.use_proxy if use_proxy is None else use_proxy
+            threading.Thread(target=self._launch, args=(relaunch_proxy,), name="driver-launch", daemon=True).start()
+            return
+
+        with self._cond:
+            self._idle[pooled.use_proxy].append(pooled)
+            self._cond.notify_all()
+
+    def lease(self, use_proxy=None):
+        """Контекстный менеджер аренды драйвера"""
+        return _DriverLease(self, use_proxy)
+
+    def shutdown(self, timeout=60):
+        """
+        Закрывает все браузеры пула. Ждёт (до timeout сек.) запускающиеся браузеры: потоки запуска
+        фоновые, и без ожидания Chrome и папка профиля остались бы после выхода процесса.
+        """
+        with self._cond:
+            self._closed = True
+            pooled = self._idle[True] + self._idle[False] + list(self._leased.values())
+            self._idle = {True: [], False: []}
+            self._leased.clear()
+            self._cond.notify_all()
+        for item in pooled:
+            item.quit()
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            # Запуск, закончившийся после закрытия пула, сам закрывает браузер (_launch)
+            while self._launching > 0 and time.monotonic() < deadline:
+                self._cond.wait(deadline - time.monotonic())
+            if self._launching:
+                logging.warning(f"Не дождались запуска {self._launching} браузеров при закрытии пула")
+
+    def stats(self):
+        with self._cond:
+            return {
+                "idle": len(self._idle[True]) + len(self._idle[False]),
+                "leased": len(self._leased),
+                "launching": self._launching,
+                "page_loads": self.load_stats.report(),
+            }
+
+
+class DriverGroup:
+    """
+    Браузеры одного парсера для параллельной загрузки страниц (до size штук).
+    Дополнительный браузер берётся из пула, только если в нём есть место, — иначе
+    ждём, пока освободится уже взятый, чтобы парсеры не отнимали браузеры друг у друга.
+    """
+
+    def __init__(self, pool, use_proxy, size, driver=None):
+        self.pool = pool
+        self.use_proxy = use_proxy
+        self.size = max(size, 1)
+        self._free = queue.LifoQueue()
+        self._leased = []  # Все браузеры группы, свободные и занятые
+        self._lock = threading.Lock()
+        self._closed = False  # После close браузеры, занятые загрузкой, возвращаются сразу в пул
+        if driver is not None:
+            self._leased.append(driver)
+            self._free.put(driver)
+
+    def borrow(self):
+        """Свободный браузер группы; при необходимости и возможности — новый из пула"""
+        try:
+            return self._free.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            grow = len(self._leased) < self.size
+            first = not self._leased
+        if grow:
+            try:
+                # Первый браузер ждём, дополнительные — только если в пуле есть место
+                driver = self.pool.acquire(use_proxy=self.use_proxy, **({} if first else {"timeout": 0}))
+                with self._lock:
+                    self._leased.append(driver)
+                return driver
+            except (TimeoutError, RuntimeError) as e:
+                if first:
+                    raise
+                logging.debug(f"Дополнительный браузер не получен ({e}) — ждём браузер группы")
+        return self._free.get()
+
+    def give_back(self, driver, borrowed):
+        """Возвращает браузер в группу; borrowed — выданный, если запрос заменил его другим"""
+        with self._lock:
+            closed = self._closed
+            if closed and borrowed in self._leased:
+                self._leased.remove(borrowed)
+        if closed:
+            # Загрузка закончилась после закрытия группы (страница уже не нужна)
+            self.pool.release(driver)
+            return
+        if driver is not borrowed:
+            with self._lock:
+                if borrowed in self._leased:
+                    self._leased.remove(borrowed)
+                if driver is not None:
+                    self._leased.append(driver)
+        if driver is not None:
+            self._free.put(driver)
+
+    def close(self):
+        """Возвращает в пул свободные браузеры группы; занятые вернутся в пул из give_back"""
+        free = []
+        while True:
+            try:
+                free.append(self._free.get_nowait())
+            except queue.Empty:
+                break
+        with self._lock:
+            self._closed = True
+            self._leased = [driver for driver in self._leased if driver not in free]
+        for driver in free:
+            self.pool.release(driver)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._leased)
+
+
+class _DriverLease:
+    def __init__(self, pool, use_proxy):
+        self.pool = pool
+        self.use_proxy = use_proxy
+        self.driver = None
+
+    def __enter__(self):
+        self.driver = self.pool.acquire(self.use_proxy)
+        return self.driver
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.pool.release(self.driver, broken=exc_type is not None)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_driver_pool():
+    """Общий на процесс пул браузеров"""
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool._closed:
+            _pool = DriverPool()
+        return _pool
@@ -0,0 +1,55 @@
+import logging
+
+from calculator import COLLATERAL_RATE, confidence_interval
+
+
+class AdaptiveStop:
+    """
+    Статистическая остановка сбора цен: после каждой страницы пересчитывается оценка
+    залоговой стоимости и её доверительный интервал; сбор останавливается, когда
+    относительная ширина интервала (high - low) / оценка не больше target_width.
+    Меньше min_prices цен не останавливает никогда; жёсткий предел — лимит агрегатора.
+    Один экземпляр на запрос, вызывается только из потока агрегатора (StreamAggregator).
+    """
+
+    def __init__(self, target_width=0.1, min_prices=20, confidence=0.95):
+        self.target_width = target_width
+        self.min_prices = min_prices
+        self.confidence = confidence
+        self.prices = []
+        self.reason = None  # Почему сбор остановлен: "interval" или "limit"
+
+    def add(self, prices):
+        """Добавляет цены страницы; возвращает True, если цен уже достаточно"""
+        self.prices.extend(prices)
+        if len(self.prices) < self.min_prices:
+            return False
+        width = self.relative_width()
+        if width <= self.target_width:
+            self.reason = "interval"
+            logging.info(f"Интервал оценки сузился до {width:.1%} на {len(self.prices)} ценах — сбор можно остановить")
+            return True
+        return False
+
+    def limit_reached(self):
+        """Сбор остановлен лимитом раньше, чем сузился интервал"""
+        if self.reason is None:
+            self.reason = "limit"
+
+    def relative_width(self):
+        mean, low, high, _ = confidence_interval(self.prices, self.confidence)
+        return (high - low) / mean if mean else float("inf")
+
+    def estimate(self):
+        """Текущая оценка залоговой стоимости с доверительным интервалом"""
+        mean, low, high, kept = confidence_interval(self.prices, self.confidence)
+        finite = kept > 1
+        return {
+            "collateral_value": round(mean * COLLATERAL_RATE),
+            "ci_low": round(low * COLLATERAL_RATE) if finite else None,
+            "ci_high": round(high * COLLATERAL_RATE) if finite else None,
+            "relative_width": round(float((high - low) / mean), 4) if finite and mean else None,
+            "confidence": self.confidence,
+            "prices": len(self.prices),
+            "stopped_by": self.reason,
+        }
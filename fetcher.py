@@ -0,0 +1,148 @@
+import asyncio
+import logging
+import random
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+from requests.exceptions import RequestException
+
+from http_sessions import get_session_manager
+from metrics import get_metrics, site_of
+from page_cache import CachedResponse, get_page_cache
+from proxy_pool import get_proxy_pool, proxy_to_url
+from rate_limiter import get_rate_limiter, looks_like_captcha, retry_after_seconds
+from site_archive import get_recorder, replay_url, replaying
+from utils import USER_AGENTS
+
+
+def build_headers(referer="https://www.avito.ru/"):
+    """Заголовки браузера для HTTP-запросов"""
+    return {
+        "User-Agent": random.choice(USER_AGENTS),
+        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
+        "Accept-Language": "ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7",
+        "Referer": referer,
+        "Connection": "keep-alive",
+        "DNT": "1",
+        "Upgrade-Insecure-Requests": "1",
+    }
+
+
+class AsyncFetcher:
+    """
+    Асинхронный загрузчик страниц через requests.
+    Запросы выполняются в пуле потоков, event loop управляет лимитами на домен,
+    повторами и паузами (asyncio.sleep не блокирует другие загрузки). Частоту запросов
+    к сайту задаёт общий ограничитель (rate_limiter).
+    Сессии с пулом соединений и cookies — общие на процесс, по (прокси, сайту).
+    """
+
+    def __init__(self, per_domain=4, retries=3, timeout=10, use_proxy=True, backoff=1.0):
+        self.per_domain = per_domain  # Одновременных запросов к одному домену
+        self.retries = retries
+        self.timeout = timeout
+        self.use_proxy = use_proxy
+        self.backoff = backoff
+        self.sessions = get_session_manager()  # Общие keep-alive сессии по (прокси, сайту)
+        self._executor = ThreadPoolExecutor(max_workers=per_domain * 4, thread_name_prefix="fetch")
+
+    def _get(self, proxy, url):
+        proxy_url = proxy_to_url(proxy) if proxy else None
+        with get_metrics().timer("http_get", site_of(url)):
+            response = self.sessions.get(replay_url(url), proxy_url, headers=build_headers(), timeout=self.timeout)
+        get_recorder().record(url, response.status_code, response.headers, response.text,
+                              response.elapsed.total_seconds(), "requests")
+        return response
+
+    async def fetch(self, url, semaphore=None, use_proxy=None):
+        """Загружает страницу; возвращает requests.Response или None"""
+        cache = get_page_cache()
+        html = cache.get(url)
+        if html is not None:
+            get_recorder().record(url, 200, None, html, None, "cache")  # Архив записи полон и при прогретом кэше
+            return CachedResponse(url, html)
+
+        use_proxy = self.use_proxy if use_proxy is None else use_proxy
+        if replaying():
+            use_proxy = False  # Сервер воспроизведения локальный: запрос через удалённый прокси до него не дойдёт
+        pool = get_proxy_pool()
+        limiter = get_rate_limiter()
+        metrics = get_metrics()
+        site = site_of(url)
+        loop = asyncio.get_running_loop()
+        proxy_used = False
+        last_exception = None
+
+        for attempt in range(1, self.retries + 1):
+            proxy = None
+            if use_proxy:
+                start = time.monotonic()
+                proxy = await loop.run_in_executor(self._executor, pool.get)
+                metrics.observe("proxy_select", time.monotonic() - start, site)
+                proxy_used = proxy_used or proxy is not None
+            try:
+                await limiter.acquire_async(url, proxy)
+                start = time.monotonic()
+                if semaphore is not None:
+                    async with semaphore:
+                        response = await loop.run_in_executor(self._executor, self._get, proxy, url)
+                else:
+                    response = await loop.run_in_executor(self._executor, self._get, proxy, url)
+
+                if response.status_code == 429 or (
+                        response.status_code == 403 and looks_like_captcha(response.url, response.text)):
+                    logging.warning(f"Попытка {attempt}/{self.retries}: {response.status_code} для {url}")
+                    # Прокси рабочий: пауза и снижение частоты — в ограничителе, следующий acquire их выдержит
+                    limiter.throttle(url, proxy, retry_after_seconds(response), reason=str(response.status_code))
+                    continue
+
+                response.raise_for_status()
+                limiter.success(url, proxy, time.monotonic() - start)
+                pool.report_success(proxy, time.monotonic() - start)
+                cache.put(url, response.text)
+                logging.info(f"Успешный запрос к {url} за {response.elapsed.total_seconds():.2f} сек.")
+                return response
+
+            except RequestException as e:
+                last_exception = e
+                pool.report_failure(proxy)
+                logging.warning(f"Попытка {attempt}/{self.retries} для {url} не удалась: {e}")
+                delay = self.backoff * 2 ** attempt + random.uniform(0, 1)
+                await asyncio.sleep(delay)
+                metrics.observe("retry_sleep", delay, site)
+
+        logging.error(f"Не удалось получить {url} после {self.retries} попыток. Последняя ошибка: {last_exception}")
+        if proxy_used:
+            logging.info("Переход на собственный IP после неудачи с прокси.")
+            return await self.fetch(url, semaphore, use_proxy=False)
+        return None
+
+    async def fetch_many(self, urls):
+        """Загружает страницы параллельно с ограничением на домен; результаты в порядке urls"""
+        semaphores = {}
+        tasks = []
+        for url in urls:
+            domain = urllib.parse.urlsplit(url).netloc
+            if domain not in semaphores:
+                semaphores[domain] = asyncio.Semaphore(self.per_domain)
+            tasks.append(self.fetch(url, semaphores[domain]))
+        return await asyncio.gather(*tasks)
+
+    def fetch_sync(self, url):
+        """Синхронная обёртка над fetch"""
+        return asyncio.run(self.fetch(url))
+
+    def fetch_many_sync(self, urls):
+        """Синхронная обёртка над fetch_many"""
+        return asyncio.run(self.fetch_many(urls))
+
+    def close(self):
+        # Сессии общие на процесс и закрываются по простою, здесь только пул потоков
+        self._executor.shutdown(wait=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,175 @@
+import logging
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+try:
+    import httpx  # Необязательная зависимость: HTTP/2 (нужен ещё пакет h2)
+except ImportError:
+    httpx = None
+
+
+def _mask(proxy_url):
+    """Прокси без логина и пароля — для статистики и журнала"""
+    if not proxy_url:
+        return "собственный IP"
+    parsed = urlparse(proxy_url)
+    return f"{parsed.hostname}:{parsed.port}"
+
+
+def _to_requests_response(response):
+    """Ответ httpx в виде requests.Response: вызывающему коду не важно, чем выполнен запрос"""
+    converted = requests.Response()
+    converted.status_code = response.status_code
+    converted._content = response.content
+    converted.headers = CaseInsensitiveDict(response.headers)
+    converted.url = str(response.url)
+    converted.encoding = response.encoding
+    converted.reason = response.reason_phrase
+    converted.elapsed = response.elapsed
+    return converted
+
+
+class PooledSession:
+    """Keep-alive сессия одного (прокси, домена): соединения и cookies живут между запросами"""
+
+    def __init__(self, proxy_url, domain, pool_maxsize, http2):
+        self.proxy_url = proxy_url
+        self.domain = domain
+        self.requests = 0
+        self.last_used = time.monotonic()
+        self.http2 = False
+        self._client = None
+        if http2 and httpx is not None:
+            try:
+                try:
+                    self._client = httpx.Client(http2=True, proxy=proxy_url, follow_redirects=True,
+                                                limits=httpx.Limits(max_connections=pool_maxsize))
+                except TypeError:  # httpx до 0.26: параметр proxies
+                    self._client = httpx.Client(http2=True, proxies=proxy_url, follow_redirects=True,
+                                                limits=httpx.Limits(max_connections=pool_maxsize))
+                self.http2 = True
+            except ImportError as e:  # Нет пакета h2
+                logging.warning(f"HTTP/2 недоступен ({e}), используем requests")
+        if self._client is None:
+            self._session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_maxsize)
+            self._session.mount("http://", adapter)
+            self._session.mount("https://", adapter)
+            if proxy_url:
+                self._session.proxies = {"http": proxy_url, "https": proxy_url}
+
+    def get(self, url, headers=None, timeout=10):
+        """GET через сессию; ошибки сети — как у requests (RequestException)"""
+        self.requests += 1
+        self.last_used = time.monotonic()
+        if self._client is None:
+            return self._session.get(url, headers=headers, timeout=timeout)
+        try:
+            return _to_requests_response(self._client.get(url, headers=headers, timeout=timeout))
+        except httpx.HTTPError as e:
+            raise requests.RequestException(str(e)) from e
+
+    def connections(self):
+        """Сколько соединений открыто за всё время (для requests; для HTTP/2 — None)"""
+        if self._client is not None:
+            return None
+        total = 0
+        for adapter in self._session.adapters.values():
+            managers = [adapter.poolmanager] + list(adapter.proxy_manager.values())
+            for manager in managers:
+                for key in list(manager.pools.keys()):
+                    pool = manager.pools.get(key)
+                    if pool is not None:
+                        total += pool.num_connections
+        return total
+
+    def close(self):
+        try:
+            (self._client or self._session).close()
+        except Exception as e:
+            logging.debug(f"Ошибка при закрытии сессии {self.domain}: {e}")
+
+
+class SessionManager:
+    """
+    Пул keep-alive HTTP-сессий по (прокси, домену) для всех запросов через requests:
+    повторные запросы не платят за TCP, TLS и CONNECT прокси, cookies сайта сохраняются.
+    http2=True — сессии на httpx с мультиплексированием (если установлены httpx и h2).
+    Сессии, простаивающие дольше idle_ttl секунд, закрываются.
+    """
+
+    def __init__(self, idle_ttl=120, pool_maxsize=8, http2=False):
+        self.idle_ttl = idle_ttl
+        self.pool_maxsize = pool_maxsize
+        self.http2 = http2
+        self._sessions = {}  # (proxy_url или None, домен) -> PooledSession
+        self._lock = threading.Lock()
+        self.created = 0
+        self.evicted = 0
+        self.reused = 0
+
+    def _evict_idle(self, now):
+        idle = [key for key, session in self._sessions.items() if now - session.last_used > self.idle_ttl]
+        for key in idle:
+            self._sessions.pop(key).close()
+        self.evicted += len(idle)
+
+    def session(self, url, proxy_url=None):
+        """Сессия для запроса к url через прокси (URL вида http://login:password@ip:port, None — свой IP)"""
+        domain = urlparse(url).netloc
+        key = (proxy_url, domain)
+        with self._lock:
+            self._evict_idle(time.monotonic())
+            session = self._sessions.get(key)
+            if session is None:
+                session = self._sessions[key] = PooledSession(proxy_url, domain, self.pool_maxsize, self.http2)
+                self.created += 1
+            else:
+                self.reused += 1
+            session.last_used = time.monotonic()
+            return session
+
+    def get(self, url, proxy_url=None, headers=None, timeout=10):
+        return self.session(url, proxy_url).get(url, headers=headers, timeout=timeout)
+
+    def stats(self):
+        """Сессии и переиспользование соединений: запросов на одно открытое соединение"""
+        with self._lock:
+            self._evict_idle(time.monotonic())
+            sessions = list(self._sessions.values())
+            stats = {"open": len(sessions), "created": self.created, "reused": self.reused, "evicted": self.evicted}
+        details = {}
+        for session in sessions:
+            connections = session.connections()
+            details[f"{session.domain} через {_mask(session.proxy_url)}"] = {
+                "requests": session.requests,
+                "connections": connections,
+                "requests_per_connection": round(session.requests / connections, 2) if connections else None,
+                "http2": session.http2,
+            }
+        stats["sessions"] = details
+        return stats
+
+    def close(self):
+        with self._lock:
+            sessions, self._sessions = list(self._sessions.values()), {}
+        for session in sessions:
+            session.close()
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_session_manager():
+    """Общий на процесс пул HTTP-сессий"""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = SessionManager()
+        return _manager
@@ -0,0 +1,226 @@
+"""
+Хранилище объявлений (SQLite): все собранные объявления с привязкой к запуску оценки.
+
+    python listing_store.py --make lada --model granta --year 2020 --days 30  # оценка по истории за 30 дней
+    python listing_store.py --run 12                                          # результат запуска 12
+"""
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from calculator import calculate_collateral
+
+STORE_PATH = "data/listings.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    make TEXT NOT NULL,
+    model TEXT NOT NULL,
+    years TEXT,
+    price_limit INTEGER,
+    started_at REAL NOT NULL,
+    finished_at REAL
+);
+CREATE TABLE IF NOT EXISTS listings (
+    id INTEGER PRIMARY KEY,
+    run_id INTEGER,
+    source TEXT NOT NULL,
+    listing_id TEXT,
+    make TEXT NOT NULL,
+    model TEXT NOT NULL,
+    year INTEGER,
+    price INTEGER,
+    mileage INTEGER,
+    city TEXT,
+    title TEXT,
+    seen_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_listings_lookup ON listings (make, model, year, source, seen_at);
+CREATE INDEX IF NOT EXISTS idx_listings_run ON listings (run_id);
+"""
+
+
+class RunWriter:
+    """Запись объявлений одного запуска: копит их и вставляет пачками по batch_size"""
+
+    def __init__(self, store, run_id, make, model, batch_size):
+        self.store = store
+        self.run_id = run_id
+        self.make = make
+        self.model = model
+        self.batch_size = batch_size
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def add(self, listings):
+        now = time.time()
+        rows = [
+            (self.run_id, listing.source, listing.listing_id, self.make, self.model, listing.year, listing.price,
+             listing.mileage, listing.city, listing.title, now)
+            for listing in listings
+        ]
+        with self._lock:
+            self._pending.extend(rows)
+            if len(self._pending) < self.batch_size:
+                return
+            rows, self._pending = self._pending, []
+        self.store._insert(rows)
+
+    def close(self):
+        """Дописывает остаток и отмечает время окончания запуска"""
+        with self._lock:
+            rows, self._pending = self._pending, []
+        if rows:
+            self.store._insert(rows)
+        self.store._finish_run(self.run_id)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class ListingStore:
+    """
+    SQLite в режиме WAL: парсеры пишут пачками, чтение истории не блокируется записью.
+    Индекс (make, model, year, source, seen_at) покрывает выборки по истории цен.
+    """
+
+    def __init__(self, path=STORE_PATH, batch_size=200):
+        self.path = path
+        self.batch_size = batch_size
+        self._lock = threading.Lock()  # Одно соединение на процесс, запись и чтение по очереди
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    def start_run(self, make, model, years=None, limit=None):
+        """Регистрирует запуск оценки и возвращает RunWriter для его объявлений"""
+        make, model = make.lower(), model.lower()
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT INTO runs (make, model, years, price_limit, started_at) VALUES (?, ?, ?, ?, ?)",
+                (make, model, json.dumps(years or []), limit, time.time()))
+        return RunWriter(self, cursor.lastrowid, make, model, self.batch_size)
+
+    def _insert(self, rows):
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO listings (run_id, source, listing_id, make, model, year, price, mileage, city, title, "
+                "seen_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def _finish_run(self, run_id):
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE runs SET finished_at = ? WHERE id = ?", (time.time(), run_id))
+
+    def listings(self, make, model, start_year=None, end_year=None, source=None, since=None, until=None):
+        """Объявления из истории; since/until — unix-время"""
+        query = "SELECT * FROM listings WHERE make = ? AND model = ?"
+        params = [make.lower(), model.lower()]
+        if start_year is not None:
+            query += " AND year BETWEEN ? AND ?"
+            params += [start_year, end_year if end_year is not None else start_year]
+        if source:
+            query += " AND source = ?"
+            params.append(source)
+        if since is not None:
+            query += " AND seen_at >= ?"
+            params.append(since)
+        if until is not None:
+            query += " AND seen_at < ?"
+            params.append(until)
+        with self._lock:
+            return [dict(row) for row in self._conn.execute(query, params)]
+
+    def run_listings(self, run_id):
+        with self._lock:
+            return [dict(row) for row in self._conn.execute(
+                "SELECT * FROM listings WHERE run_id = ? ORDER BY id", (run_id,))]
+
+    def summary(self, make, model, start_year=None, end_year=None, source=None, since=None, until=None):
+        """Оценка по истории: тот же расчёт, что и в main.py"""
+        rows = [row for row in self.listings(make, model, start_year, end_year, source, since, until) if row["price"]]
+        return {
+            "make": make,
+            "model": model,
+            "year": [year for year in (start_year, end_year) if year is not None],
+            **self._valuate(rows),
+        }
+
+    @staticmethod
+    def _valuate(rows):
+        return calculate_collateral([row["price"] for row in rows], years=[row["year"] for row in rows],
+                                    sources=[row["source"] for row in rows])
+
+    def run_result(self, run_id):
+        """Результат запуска, пересчитанный из его объявлений (первые limit, как в main.py)"""
+        with self._lock:
+            run = self._conn.execute("SELECT * FROM runs WHERE id = ?", (run_id,)).fetchone()
+        if run is None:
+            return None
+        rows = self.run_listings(run_id)
+        if run["price_limit"]:
+            rows = rows[:run["price_limit"]]
+        return {
+            "run_id": run_id,
+            "make": run["make"],
+            "model": run["model"],
+            "year": json.loads(run["years"] or "[]"),
+            "limit": run["price_limit"],
+            **self._valuate(rows),
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_listing_store():
+    """Общее хранилище объявлений процесса"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ListingStore()
+        return _store
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Оценка по истории собранных объявлений")
+    parser.add_argument("--make", help="Марка автомобиля")
+    parser.add_argument("--model", help="Модель автомобиля")
+    parser.add_argument("--year", nargs='+', type=int, help="Год или диапазон годов")
+    parser.add_argument("--source", help="Только один сайт: auto.ru, drom.ru, avito.ru")
+    parser.add_argument("--days", type=float, help="Только объявления за последние N дней")
+    parser.add_argument("--until", help="Только объявления до даты ДД-ММ-ГГГГ")
+    parser.add_argument("--run", type=int, help="Результат конкретного запуска")
+    args = parser.parse_args()
+
+    store = get_listing_store()
+    if args.run:
+        result = store.run_result(args.run)
+    elif args.make and args.model:
+        years = args.year or []
+        since = time.time() - args.days * 86400 if args.days else None
+        until = datetime.strptime(args.until, "%d-%m-%Y").timestamp() if args.until else None
+        result = store.summary(args.make, args.model, years[0] if years else None, years[-1] if years else None,
+                               args.source, since, until)
+    else:
+        parser.error("укажите --make и --model или --run")
+    print(json.dumps(result, indent=4, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
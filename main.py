@@ -1,13 +1,32 @@
-import re
+import time
+
+STARTED = time.perf_counter()  # Отсчёт запуска — до импорта остальных модулей
 import argparse
+import contextvars
 import json
 import threading
 import logging
+from batch import run_batch
 from calculator import calculate_collateral
+from aggregator import StreamAggregator
+from dedupe import DedupeIndex
+from early_stop import AdaptiveStop
+from quota import QuotaScheduler
+from driver_pool import get_driver_pool
+from listing_store import get_listing_store
+from metrics import get_metrics
+from http_sessions import get_session_manager
+from page_cache import get_page_cache
+from rate_limiter import get_rate_limiter
+from site_archive import get_recorder, set_replay_base
+from structured_log import new_query_id
 from datetime import datetime
 from parsers import AvitoParser, AutoRuParser, DromParser
+from parsers.extractors import DEFAULT_ENGINE, ENGINES, set_default_engine
 from utils import setup_logging  # логирование
-from threading import Event, Lock
+from threading import Event
+
+IMPORTED = time.perf_counter()
 
 
 def normalize_make(make, site):
@@ -19,74 +38,209 @@ def normalize_make(make, site):
     return mapping.get(site, {}).get(make.lower(), make.lower())
 
 
-def main():
-    setup_logging()
-
-    start_time = datetime.now()
-    logging.info(f"Старт скрипта: {start_time.strftime('%d-%m-%Y %H:%M:%S')}")
-
-    parser = argparse.ArgumentParser(description="Расчет залоговой стоимости автомобиля")
-    parser.add_argument("--make", required=True, help="Марка автомобиля")
-    parser.add_argument("--model", required=True, help="Модель автомобиля")
-    parser.add_argument("--year", nargs='+', type=int, help="Год выпуска автомобиля или диапазон годов (например: 2020 или 2019 2021)")
-    parser.add_argument("--limit", type=int, default=100, help="Количество цен для парсинга (от 10 до 100)")
-    args = parser.parse_args()
-
-    if args.limit < 10 or args.limit > 100:
-        print("Ошибка: Количество цен должно быть в диапазоне от 10 до 100.")
-        return
-
-    make, model, year, limit = args.make, args.model, args.year, args.limit
-
-    sanitized_make = re.sub(r'[^a-zA-Z0-9]', '_', make.lower())
-    sanitized_model = re.sub(r'[^a-zA-Z0-9]', '_', model.lower())
+def validate_limit(limit):
+    """Проверка лимита цен; возвращает текст ошибки или None"""
+    if limit < 1:
+        return "Ошибка: Количество цен должно быть положительным числом."
+    return None
+
+
+def resolve_limit(limit, target_width=None, max_prices=500):
+    """
+    Лимит цен оценки: со статистической остановкой — предел max_prices (свой лимит тогда не указывается),
+    иначе limit или 100. Возвращает (лимит, текст ошибки или None).
+    """
+    if target_width:
+        if limit is not None:
+            return None, "Ошибка: лимит не используется с --target-width: предел сбора задаёт --max-prices."
+        limit = max_prices  # Сколько собирать, решает правило остановки; лимит — только предел
+    elif limit is None:
+        limit = 100
+    return limit, validate_limit(limit)
+
+
+def parse_weights(values):
+    """["auto.ru=1", "drom.ru=2"] -> {"auto.ru": 1.0, "drom.ru": 2.0}"""
+    weights = {}
+    for value in values or []:
+        source, _, weight = value.partition("=")
+        weights[source.strip()] = float(weight)
+    return weights
+
+
+def run_query(make, model, year, limit, use_proxy=True, save=True, incremental=False, target_width=None, min_prices=20,
+              quota_mode="yield", weights=None, on_progress=None, parallel_pages=2):
+    """
+    Одна оценка: параллельный парсинг сайтов и расчёт залоговой стоимости (save — запись объявлений в хранилище).
+    Лимит делится между сайтами по квотам (quota_mode "yield" — по выходу страниц, "static" — по weights).
+    С target_width сбор останавливается, как только доверительный интервал оценки уже target_width
+    (но не раньше min_prices цен); limit тогда — верхний предел.
+    on_progress(progress) вызывается после каждой обработанной страницы с промежуточной оценкой.
+    """
+
+    query_id = new_query_id()  # Все события журнала этой оценки помечаются query_id
+    logging.info(f"Оценка {query_id}: {make} {model} {year or ''}, лимит {limit}")
 
     # Создаем общий объект Event для остановки парсеров
     stop_event = Event()
-    found_prices = []
-    lock = Lock()
+    dedupe = DedupeIndex()  # Одна машина на нескольких сайтах учитывается один раз
+    store = get_listing_store().start_run(make, model, year, limit) if save else None
+    stopper = AdaptiveStop(target_width, min_prices) if target_width else None  # Предел — limit агрегатора
+    scheduler = QuotaScheduler(limit, [AutoRuParser.site, DromParser.site], weights, quota_mode, stop_event)
+    # Объявления всех парсеров обрабатываются одним потоком агрегатора по мере поступления
+    aggregator = StreamAggregator(limit, stop_event, dedupe, scheduler, store, stopper, on_progress).start()
 
     # Инициализация парсеров без локального лимита
     logging.info("Начало инициализации парсеров в main...")
     parsers = [
-        #AvitoParser(normalize_make(make, "avito.ru"), model, year, stop_event, found_prices, lock, limit=limit, use_proxy=True),
-        AutoRuParser(normalize_make(make, "auto.ru"), model, year, stop_event, found_prices, lock, limit=limit, use_proxy=True),
-        DromParser(normalize_make(make, "drom.ru"), model, year, stop_event, found_prices, lock, limit=limit, use_proxy=True)
+        #AvitoParser(normalize_make(make, "avito.ru"), model, year, stop_event, aggregator, limit=limit, use_proxy=use_proxy, incremental=incremental, scheduler=scheduler, parallel_pages=parallel_pages),
+        AutoRuParser(normalize_make(make, "auto.ru"), model, year, stop_event, aggregator, limit=limit, use_proxy=use_proxy, incremental=incremental, scheduler=scheduler, parallel_pages=parallel_pages),
+        DromParser(normalize_make(make, "drom.ru"), model, year, stop_event, aggregator, limit=limit, use_proxy=use_proxy, incremental=incremental, scheduler=scheduler, parallel_pages=parallel_pages)
     ]
     logging.info("Инициализация парсеров в main завершена.")
     # Многопоточный парсинг
-    threads = [threading.Thread(target=parser.parse) for parser in parsers]
+    threads = [threading.Thread(target=contextvars.copy_context().run, args=(parser.parse,), name=f"parser-{parser.site}")
+               for parser in parsers]
     for t in threads:
         t.start()
 
     # Ждем завершения всех потоков
     for t in threads:
         t.join()
+    aggregator.close()
+    if store is not None:
+        store.close()
+    found_listings = aggregator.listings
 
     # Логируем общее количество найденных цен
-    logging.info(f"Всего найдено цен: {len(found_prices)}")
+    logging.info(f"Всего найдено цен: {len(found_listings)}, отброшено повторов: {dedupe.merged}")
 
     # Если меньше лимита цен:
-    if len(found_prices) < limit:
-        logging.warning(f"Собрано меньше {limit} цен: {len(found_prices)}")
+    if len(found_listings) < limit and not (stopper and stopper.reason):
+        logging.warning(f"Собрано меньше {limit} цен: {len(found_listings)}")
 
     # Расчёт залоговой стоимости
-    result = calculate_collateral(found_prices[:limit])
+    selected = found_listings[:limit]
+    prices = [listing.price for listing in selected]
+    result = calculate_collateral(prices, years=[listing.year for listing in selected],
+                                  sources=[listing.source for listing in selected])
     output = {
         "make": make,
         "model": model,
         "year": year,
         "limit": limit,
-        "cars_parsed": len(found_prices[:limit]),  # Учитываем только лимит
-        **result
+        "cars_parsed": len(prices),  # Учитываем только лимит
+        **result,
+        "duplicates_merged": dedupe.merged,
+        "query_id": query_id,
     }
+    output["sources"] = scheduler.stats()
+    if stopper is not None:
+        output["early_stop"] = stopper.estimate()
+    if store is not None:
+        output["run_id"] = store.run_id  # Результат можно пересчитать из хранилища: listing_store.py --run <id>
 
-    # Сохранение результатов
-    filename = f"data/{datetime.now().strftime('%d-%m-%Y__%H-%M')}_{sanitized_make}_{sanitized_model}_{'_'.join(map(str, year))}_results.json"
-    with open(filename, 'w', encoding='utf-8') as f:
-        json.dump(output, f, indent=4, ensure_ascii=False)
+    return output
 
-    print(json.dumps(output, indent=4, ensure_ascii=False))
+
+def main():
+    start_time = datetime.now()
+
+    parser = argparse.ArgumentParser(description="Расчет залоговой стоимости автомобиля")
+    parser.add_argument("--make", help="Марка автомобиля")
+    parser.add_argument("--model", help="Модель автомобиля")
+    parser.add_argument("--year", nargs='+', type=int, help="Год выпуска автомобиля или диапазон годов (например: 2020 или 2019 2021)")
+    parser.add_argument("--limit", type=int, help="Количество цен для парсинга (по умолчанию 100)")
+    parser.add_argument("--cache-ttl", type=int, default=3600, help="Время жизни страниц в кэше, сек (0 — не использовать кэш)")
+    parser.add_argument("--target-width", type=float,
+                        help="Остановить сбор, когда доверительный интервал оценки уже этой доли (например 0.1 = 10%%)")
+    parser.add_argument("--min-prices", type=int, default=20, help="Минимум цен до статистической остановки")
+    parser.add_argument("--max-prices", type=int, default=500, help="Предел цен при статистической остановке")
+    parser.add_argument("--quota-mode", choices=["yield", "static"], default="yield",
+                        help="Деление лимита между сайтами: по выходу страниц или по статическим весам")
+    parser.add_argument("--weights", nargs='+', help="Веса сайтов, например: auto.ru=1 drom.ru=2")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Листать выдачу только до уже известных объявлений, цены остальных брать из прошлых запусков")
+    parser.add_argument("--parallel-pages", type=int, default=2,
+                        help="Сколько страниц сайта загружать одновременно (каждую своим браузером)")
+    parser.add_argument("--full-load", action="store_true",
+                        help="Загружать страницы полностью (картинки, шрифты, стили, счётчики) — для сравнения трафика")
+    parser.add_argument("--engine", choices=sorted(ENGINES), default=DEFAULT_ENGINE,
+                        help="Движок разбора страниц (state — встроенное состояние, пока экспериментально)")
+    parser.add_argument("--http2", action="store_true", help="HTTP-запросы через HTTP/2 (нужны пакеты httpx и h2)")
+    parser.add_argument("--batch", help="Файл заданий JSONL или CSV (make, model, year, limit) для пакетной оценки")
+    parser.add_argument("--workers", type=int, default=2, help="Сколько оценок пакета выполнять одновременно")
+    parser.add_argument("--output", help="Куда построчно писать результаты пакета (по умолчанию stdout)")
+    parser.add_argument("--summary", help="Файл сводки пакета (по умолчанию data/batch_<время>_summary.json)")
+    parser.add_argument("--metrics", help="Куда сохранить время этапов по сайтам: .prom — формат Prometheus, иначе JSON")
+    parser.add_argument("--record", help="Записывать все загруженные страницы в архив (папка) для воспроизведения")
+    parser.add_argument("--replay", help="Загружать страницы с сервера воспроизведения (bench/replay_server.py), например http://127.0.0.1:8800")
+    parser.add_argument("--log-json", action="store_true",
+                        help="Журнал в logs/ в формате JSONL (run_id, query_id, выборочные события по объявлениям)")
+    parser.add_argument("--log-level", default="DEBUG", choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+                        help="Уровень журнала (по умолчанию DEBUG)")
+    args = parser.parse_args()
+
+    setup_logging(structured=args.log_json, level=args.log_level)
+    logging.info(f"Старт скрипта: {start_time.strftime('%d-%m-%Y %H:%M:%S')}")
+
+    if not args.batch and not (args.make and args.model):
+        parser.error("укажите --make и --model или файл заданий --batch")
+
+    if args.target_width and args.limit is not None:
+        parser.error("--limit не используется с --target-width: предел сбора задаёт --max-prices")
+    # Задания пакета получают лимит по тем же правилам
+    job_limit = lambda limit: resolve_limit(limit, args.target_width, args.max_prices)
+    args.limit, error = job_limit(args.limit)
+    if error:
+        print(error)
+        return
+    options = dict(incremental=args.incremental, target_width=args.target_width, min_prices=args.min_prices,
+                   quota_mode=args.quota_mode, weights=parse_weights(args.weights), parallel_pages=args.parallel_pages,
+                   use_proxy=not args.replay)  # Сервер воспроизведения локальный — без прокси
+
+    # Кэш страниц общий для всех парсеров
+    get_page_cache().ttl = args.cache_ttl
+    get_session_manager().http2 = args.http2
+    set_default_engine(args.engine)
+    if args.record:
+        get_recorder().start(args.record)
+    set_replay_base(args.replay)
+
+    # Браузеры запускаются при первой странице не из кэша: оценка по кэшу Chrome не запускает
+    driver_pool = get_driver_pool()
+    # По браузеру на каждую одновременно загружаемую страницу auto.ru и drom.ru каждой оценки
+    driver_pool.size = (args.workers if args.batch else 1) * 2 * max(args.parallel_pages, 1)
+    driver_pool.use_proxy = not args.replay
+    driver_pool.lean = not args.full_load
+    # Сколько стоит запуск до начала парсинга (без браузеров)
+    ready = time.perf_counter()
+    logging.info(f"Запуск за {ready - STARTED:.2f} сек.: импорт модулей {IMPORTED - STARTED:.2f}, "
+                 f"настройка {ready - IMPORTED:.2f}")
+
+    try:
+        if args.batch:
+            query = lambda make, model, year, limit: run_query(make, model, year, limit, **options)
+            run_batch(args.batch, query, job_limit, workers=args.workers, output=args.output, summary=args.summary)
+        else:
+            output = run_query(args.make, args.model, args.year, args.limit, **options)
+            print(json.dumps(output, indent=4, ensure_ascii=False))
+    finally:
+        page_loads = driver_pool.load_stats.report()
+        if page_loads:
+            logging.info(f"Трафик страниц по сайтам: {json.dumps(page_loads, ensure_ascii=False)}")
+        sessions = get_session_manager()
+        logging.info(f"HTTP-сессии: {json.dumps(sessions.stats(), ensure_ascii=False)}")
+        sessions.close()
+        rates = get_rate_limiter().rates()
+        if rates:
+            logging.info(f"Частота запросов к сайтам: {json.dumps(rates, ensure_ascii=False)}")
+        metrics = get_metrics()
+        logging.info(f"Время этапов по сайтам: {json.dumps(metrics.snapshot()['stages'], ensure_ascii=False)}")
+        if args.metrics:
+            metrics.write(args.metrics)
+            logging.info(f"Метрики сохранены в {args.metrics}")
+        driver_pool.shutdown()
 
     end_time = datetime.now()
     duration = end_time - start_time
@@ -97,4 +251,3 @@ def main():
 
 if __name__ == "__main__":
     main()
-
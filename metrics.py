@@ -0,0 +1,167 @@
+import json
+import math
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+# Границы корзин гистограмм, сек
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Этапы, которые меряются (для справки и порядка вывода)
+STAGES = (
+    "proxy_select",  # Выбор прокси из пула
+    "driver_launch",  # Запуск браузера для пула
+    "driver_acquire",  # Ожидание браузера из пула или группы парсера
+    "domain_slot_wait",  # Ожидание слота параллельной загрузки сайта
+    "quota_wait",  # Ожидание квоты планировщика
+    "rate_limit_wait",  # Пауза ограничителя частоты
+    "retry_sleep",  # Пауза между повторными попытками
+    "driver_get",  # driver.get
+    "dom_wait",  # Ожидание объявлений в DOM
+    "page_source",  # Сериализация страницы (driver.page_source)
+    "http_get",  # Запрос через requests/httpx
+    "fetch",  # Загрузка страницы целиком, включая все паузы и повторы
+    "parse",  # Разбор страницы от отправки в пул до результата
+    "extract",  # Работа экстрактора в процессе пула
+)
+
+PROMETHEUS_NAME = "valuation_stage_seconds"
+
+
+def site_of(url):
+    """Сайт для метрик: https://auto.drom.ru/... -> drom.ru"""
+    host = urlparse(url).hostname or ""
+    return ".".join(host.split(".")[-2:])
+
+
+class Histogram:
+    """Гистограмма времени одного этапа на одном сайте"""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # Последняя корзина — больше BUCKETS[-1]
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        index = len(BUCKETS)
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                index = i
+                break
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q):
+        """Оценка квантиля по корзинам (верхняя граница корзины, не больше максимума)"""
+        if not self.count:
+            return None
+        rank = math.ceil(q * self.count)
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(BUCKETS[i], self.max) if i < len(BUCKETS) else self.max
+        return self.max
+
+    def summary(self):
+        p50, p95 = self.quantile(0.5), self.quantile(0.95)
+        return {
+            "count": self.count,
+            "total_sec": round(self.sum, 3),
+            "avg_sec": round(self.sum / self.count, 4) if self.count else None,
+            "p50_sec": round(p50, 4) if p50 is not None else None,
+            "p95_sec": round(p95, 4) if p95 is not None else None,
+            "max_sec": round(self.max, 4),
+        }
+
+
+class Metrics:
+    """
+    Время этапов оценки (выбор прокси, браузер, загрузка, ожидание DOM, разбор, паузы, блокировки)
+    в гистограммах по сайтам. Снимок — JSON (snapshot) или текст для Prometheus (prometheus).
+    """
+
+    def __init__(self):
+        self._histograms = {}  # (этап, сайт) -> Histogram
+        self._lock = threading.Lock()
+        self.started = time.time()
+
+    def observe(self, stage, seconds, site=None):
+        key = (stage, site or "all")
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(max(seconds, 0.0))
+
+    @contextmanager
+    def timer(self, stage, site=None):
+        """with metrics.timer("driver_get", "auto.ru"): ... — время блока, в том числе при исключении"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start, site)
+
+    def _items(self):
+        order = {stage: i for i, stage in enumerate(STAGES)}
+        with self._lock:
+            items = [(key, histogram.counts[:], histogram.count, histogram.sum, histogram.max)
+                     for key, histogram in self._histograms.items()]
+        return sorted(items, key=lambda item: (order.get(item[0][0], len(order)), item[0]))
+
+    def snapshot(self):
+        """{"stages": {этап: {сайт: count, total_sec, avg_sec, p50_sec, p95_sec, max_sec}}}"""
+        stages = {}
+        for (stage, site), counts, count, total, maximum in self._items():
+            histogram = Histogram()
+            histogram.counts, histogram.count, histogram.sum, histogram.max = counts, count, total, maximum
+            stages.setdefault(stage, {})[site] = histogram.summary()
+        return {"uptime_sec": round(time.time() - self.started, 1), "stages": stages}
+
+    def prometheus(self):
+        """Снимок в текстовом формате Prometheus (гистограмма valuation_stage_seconds)"""
+        lines = [
+            f"# HELP {PROMETHEUS_NAME} Время этапов оценки по сайтам, сек",
+            f"# TYPE {PROMETHEUS_NAME} histogram",
+        ]
+        for (stage, site), counts, count, total, _ in self._items():
+            labels = f'stage="{stage}",site="{site}"'
+            cumulative = 0
+            for bound, bucket in zip(BUCKETS, counts):
+                cumulative += bucket
+                lines.append(f'{PROMETHEUS_NAME}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'{PROMETHEUS_NAME}_bucket{{{labels},le="+Inf"}} {count}')
+            lines.append(f"{PROMETHEUS_NAME}_sum{{{labels}}} {total:.6f}")
+            lines.append(f"{PROMETHEUS_NAME}_count{{{labels}}} {count}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Сохраняет снимок в файл: .prom — формат Prometheus, иначе JSON"""
+        with open(path, "w", encoding="utf-8") as f:
+            if path.endswith(".prom"):
+                f.write(self.prometheus())
+            else:
+                json.dump(self.snapshot(), f, ensure_ascii=False, indent=2)
+
+    def reset(self):
+        with self._lock:
+            self._histograms = {}
+            self.started = time.time()
+
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics():
+    """Общие на процесс метрики времени этапов"""
+    global _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = Metrics()
+        return _metrics
@@ -0,0 +1,219 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import urllib.parse
+import zlib
+
+CACHE_DIR = "cache"
+CACHE_KINDS = ("pages", "parsed", "urls")  # Папки кэша, все учитываются в max_bytes
+
+
+def normalize_url(url):
+    """Нормализует URL для ключа кэша: регистр схемы и хоста, порядок параметров, без фрагмента"""
+    parts = urllib.parse.urlsplit(url.strip())
+    query = urllib.parse.urlencode(sorted(urllib.parse.parse_qsl(parts.query, keep_blank_values=True)))
+    path = parts.path or "/"
+    return urllib.parse.urlunsplit((parts.scheme.lower(), parts.netloc.lower(), path, query, ""))
+
+
+def fingerprint(html):
+    """Отпечаток содержимого страницы"""
+    if isinstance(html, str):
+        html = html.encode("utf-8")
+    return hashlib.sha256(html).hexdigest()
+
+
+def parsed_key(site, engine, html, *filters):
+    """Ключ результата разбора: сайт, движок разбора, фильтры и отпечаток страницы"""
+    return f"{site}:{engine}:{':'.join(map(str, filters))}:{fingerprint(html)}"
+
+
+class CachedResponse:
+    """Минимальная замена requests.Response для страниц из кэша"""
+
+    status_code = 200
+
+    def __init__(self, url, text):
+        self.url = url
+        self.text = text
+
+    @property
+    def content(self):
+        return self.text.encode("utf-8")
+
+
+class PageCache:
+    """
+    Кэш HTML-страниц на диске.
+    URL (после нормализации) указывает на отпечаток содержимого, само содержимое хранится
+    сжатым один раз на отпечаток. Записи старше ttl не выдаются, при превышении max_bytes
+    (страницы, результаты разбора и записи URL вместе) удаляются давно не использованные
+    файлы (LRU по времени последнего обращения).
+    По отпечатку также кэшируется результат разбора страницы, чтобы не разбирать её повторно.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, ttl=3600, max_bytes=200 * 1024 * 1024, enabled=True):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._size = None  # Текущий размер содержимого, считается при первой записи
+        self.hits = 0
+        self.misses = 0
+
+    def _dir(self, kind):
+        path = os.path.join(self.cache_dir, kind)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def _url_path(self, url):
+        key = hashlib.sha1(normalize_url(url).encode("utf-8")).hexdigest()
+        return os.path.join(self._dir("urls"), f"{key}.json")
+
+    def _blob_path(self, page_fingerprint):
+        return os.path.join(self._dir("pages"), f"{page_fingerprint}.z")
+
+    def _parsed_path(self, key):
+        name = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return os.path.join(self._dir("parsed"), f"{name}.json")
+
+    def is_fresh(self, url):
+        """Есть ли в кэше неустаревшая запись для URL"""
+        if not self.enabled or self.ttl <= 0:
+            return False
+        try:
+            with open(self._url_path(url), "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            return time.time() - entry["fetched_at"] <= self.ttl and os.path.exists(
+                self._blob_path(entry["fingerprint"]))
+        except (OSError, ValueError, KeyError):
+            return False
+
+    def get(self, url):
+        """Возвращает HTML страницы из кэша или None, если записи нет или она устарела"""
+        if not self.enabled or self.ttl <= 0:
+            return None
+        try:
+            with open(self._url_path(url), "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            if time.time() - entry["fetched_at"] > self.ttl:
+                self.misses += 1
+                return None
+            blob_path = self._blob_path(entry["fingerprint"])
+            with open(blob_path, "rb") as f:
+                html = zlib.decompress(f.read()).decode("utf-8")
+            os.utime(blob_path)  # Отмечаем обращение для LRU
+        except (OSError, ValueError, KeyError, zlib.error):
+            self.misses += 1
+            return None
+        self.hits += 1
+        logging.info(f"Страница {url} взята из кэша")
+        return html
+
+    def invalidate(self, url):
+        """Удаляет запись URL (например, если вместо объявлений пришла капча)"""
+        path = self._url_path(url)
+        with self._lock:
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+                self._add_size(-size)
+            except OSError:
+                pass
+
+    def put(self, url, html):
+        """Сохраняет страницу; возвращает её отпечаток"""
+        page_fingerprint = fingerprint(html)
+        if not self.enabled or not html:
+            return page_fingerprint
+        try:
+            with self._lock:
+                blob_path = self._blob_path(page_fingerprint)
+                if not os.path.exists(blob_path):
+                    data = zlib.compress(html.encode("utf-8"), 6)
+                    with open(blob_path, "wb") as f:
+                        f.write(data)
+                    self._add_size(len(data))
+                else:
+                    os.utime(blob_path)
+                entry = {"url": normalize_url(url), "fingerprint": page_fingerprint, "fetched_at": time.time()}
+                self._write(self._url_path(url), json.dumps(entry).encode("utf-8"))
+                self._evict()
+        except OSError as e:
+            logging.warning(f"Не удалось сохранить страницу {url} в кэш: {e}")
+        return page_fingerprint
+
+    def get_parsed(self, key):
+        """Результат разбора страницы по ключу (обычно сайт + движок + фильтры + отпечаток) или None"""
+        if not self.enabled:
+            return None
+        path = self._parsed_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                result = json.load(f)
+            os.utime(path)  # Отмечаем обращение для LRU
+            return result
+        except (OSError, ValueError):
+            return None
+
+    def put_parsed(self, key, result):
+        if not self.enabled:
+            return
+        try:
+            with self._lock:
+                self._write(self._parsed_path(key), json.dumps(result, ensure_ascii=False).encode("utf-8"))
+                self._evict()
+        except OSError as e:
+            logging.warning(f"Не удалось сохранить результат разбора в кэш: {e}")
+
+    def _write(self, path, data):
+        """Записывает (перезаписывает) файл кэша с учётом размера; вызывается под блокировкой"""
+        try:
+            previous = os.path.getsize(path)
+        except OSError:
+            previous = 0
+        with open(path, "wb") as f:
+            f.write(data)
+        self._add_size(len(data) - previous)
+
+    def _files(self):
+        return [entry for kind in CACHE_KINDS for entry in os.scandir(self._dir(kind))]
+
+    def _add_size(self, delta):
+        if self._size is None:
+            self._size = sum(entry.stat().st_size for entry in self._files())
+        else:
+            self._size += delta
+
+    def _evict(self):
+        """Удаляет давно не использованные файлы кэша, пока он больше max_bytes"""
+        if self._size is None or self._size <= self.max_bytes:
+            return
+        files = sorted(self._files(), key=lambda e: e.stat().st_mtime)
+        for entry in files:
+            if self._size <= self.max_bytes * 0.9:
+                break
+            size = entry.stat().st_size
+            try:
+                os.remove(entry.path)
+                self._size -= size
+            except OSError:
+                continue
+        logging.info(f"Кэш страниц очищен до {self._size / (1024 * 1024):.1f} МБ")
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_page_cache():
+    """Общий на процесс кэш страниц"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = PageCache()
+        return _cache
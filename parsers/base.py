@@ -0,0 +1,248 @@
+import contextvars
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import time
+from metrics import get_metrics
+from page_cache import get_page_cache, parsed_key
+from aggregator import StreamAggregator
+from seen_listings import SeenListings
+from .extractors import Listing, filter_listings, get_extractor
+from .parse_pool import get_parse_pool
+
+PAGES_PER_DOMAIN = 3  # Сколько страниц одного сайта загружается одновременно (на все запросы процесса)
+
+_domain_slots = {}
+_domain_slots_lock = threading.Lock()
+
+
+def _domain_slot(site):
+    """Общее на процесс ограничение одновременных загрузок страниц сайта"""
+    with _domain_slots_lock:
+        if site not in _domain_slots:
+            _domain_slots[site] = threading.BoundedSemaphore(PAGES_PER_DOMAIN)
+        return _domain_slots[site]
+
+
+class BaseParser:
+    """
+    Общая часть парсеров: параметры запроса, листание выдачи с разбором страниц в пуле процессов,
+    передача объявлений в общий агрегатор запроса, квоты сайтов и инкрементальный режим
+    (остановка на странице, где все объявления уже известны).
+    Парсеру с постраничной выдачей достаточно определить _page_url и _fetch;
+    parallel_pages страниц загружаются одновременно (каждая своим браузером).
+    """
+
+    site = None
+
+    def __init__(self, make, model, year=None, stop_event=None, aggregator=None, limit=100,
+                 use_proxy=True, incremental=False, scheduler=None, parallel_pages=1):
+        self.make = make
+        self.model = model
+        self.year = year if isinstance(year, list) else [year] if year else []
+        self.stop_event = stop_event  # Флаг остановки
+        self.limit = limit  # Сохраняем лимит
+        self.use_proxy = use_proxy
+        # Общий для всех парсеров запроса приёмник объявлений; без него у парсера свой
+        self.own_aggregator = aggregator is None
+        self.aggregator = aggregator or StreamAggregator(limit, stop_event).start()
+        self.scheduler = scheduler  # Квоты сайтов в общем лимите (QuotaScheduler)
+        self.logger = logging.getLogger(type(self).__module__)
+        self.cache = get_page_cache()
+        self.metrics = get_metrics()
+        self.extractor = get_extractor(self.site)
+        self.parse_pool = get_parse_pool()
+        self.parallel_pages = max(parallel_pages, 1)  # Сколько страниц загружать одновременно
+        self._pagination_done = threading.Event()  # Листать дальше не нужно
+
+        # Инкрементальный режим: известные объявления запроса сохраняются между запусками
+        self.seen = SeenListings(self.site, make, model, self.year) if incremental else None
+        self.seen_this_run = set()
+        self.stopped_on_known = False
+
+    def _year_range(self):
+        """Диапазон годов (start_year, end_year) или (None, None)"""
+        if len(self.year) == 2:
+            return self.year[0], self.year[1]
+        if len(self.year) == 1:
+            return self.year[0], self.year[0]
+        return None, None
+
+    def _may_continue(self, wait=True):
+        """
+        Можно ли загружать следующую страницу: нет общей остановки и у сайта есть квота
+        (иначе ждём её; wait=False — не ждём, пока есть необработанные страницы).
+        """
+        if self.stop_event.is_set():
+            return False
+        if self.scheduler is None:
+            return True
+        if not wait:
+            return self.scheduler.has_quota(self.site)
+        with self.metrics.timer("quota_wait", self.site):
+            return self.scheduler.wait_for_quota(self.site)
+
+    def _page_listings(self, page, html):
+        """Объявления страницы и признак следующей страницы (с ожиданием разбора)"""
+        return self._parse_async(page, html).result()
+
+    def _parse_async(self, page, html):
+        """
+        Future с (объявления, has_next): страница разбирается в пуле процессов,
+        неизменившаяся страница не разбирается повторно.
+        """
+        # Другой движок или состав полей — другой ключ
+        page_key = parsed_key(self.site, self.extractor.engine, html, *Listing._fields)
+        parsed = self.cache.get_parsed(page_key)
+        if parsed:
+            self.logger.info(f"Страница {page} не изменилась — используем результат разбора из кэша")
+            result = Future()
+            result.set_result(([Listing(*listing) for listing in parsed["listings"]], parsed["has_next"]))
+            return result
+
+        self.logger.info(f"Обрабатываю страницу {page}...")
+        submitted = time.perf_counter()
+        result = self.parse_pool.submit(self.site, self.extractor.engine, html)
+
+        def store(future):
+            self.metrics.observe("parse", time.perf_counter() - submitted, self.site)
+            if future.exception() is None:
+                listings, has_next = future.result()
+                self.cache.put_parsed(page_key, {"listings": listings, "has_next": has_next})
+
+        result.add_done_callback(store)
+        return result
+
+    def _page_url(self, page):
+        """Адрес страницы выдачи"""
+        raise NotImplementedError
+
+    def _fetch(self, page, url):
+        """HTML страницы выдачи или None при ошибке"""
+        raise NotImplementedError
+
+    def _load_page(self, page):
+        """
+        Выполняется в потоке загрузчика: загружает страницу и отдаёт её в разбор.
+        Возвращает future разбора, None при ошибке или если страница уже не нужна.
+        Паузы между запросами к сайту выдерживает общий ограничитель частоты (rate_limiter).
+        """
+        if self._pagination_done.is_set():
+            return None
+
+        url = self._page_url(page)
+        slot = _domain_slot(self.site)
+        with self.metrics.timer("domain_slot_wait", self.site):
+            slot.acquire()
+        if self._pagination_done.is_set():  # Пока ждали слот, листание закончилось
+            slot.release()
+            return None
+        try:
+            with self.metrics.timer("fetch", self.site):
+                html = self._fetch(page, url)
+        finally:
+            slot.release()
+        if not html:
+            if not self._pagination_done.is_set():
+                self.logger.error(f"Не удалось получить страницу {page}")
+            return None
+        return self._parse_async(page, html)
+
+    def _crawl(self, start_year, end_year):
+        """
+        Листает выдачу, пока есть следующая страница, квота и нет общей остановки.
+        Адреса страниц известны заранее, поэтому до parallel_pages страниц загружаются
+        одновременно, а разбор идёт в пуле процессов. Результаты обрабатываются строго
+        по порядку страниц; как только страница оказалась последней (или пора остановиться),
+        новые страницы не запрашиваются, а загруженные сверх неё отбрасываются.
+        Возвращает число обработанных страниц.
+        """
+        self._pagination_done.clear()
+        processed = 0
+        next_page = 1
+        pending = OrderedDict()  # Страница -> future загрузки, по порядку страниц
+        loaders = ThreadPoolExecutor(max_workers=self.parallel_pages, thread_name_prefix=f"{self.site}-pages")
+
+        def fill(wait):
+            nonlocal next_page
+            while len(pending) < self.parallel_pages and self._may_continue(wait=wait and not pending):
+                # Загрузчик работает в контексте парсера: query_id журнала тот же
+                pending[next_page] = loaders.submit(contextvars.copy_context().run, self._load_page, next_page)
+                next_page += 1
+
+        try:
+            while True:
+                fill(wait=True)
+                if not pending:
+                    break
+
+                page, loading = pending.popitem(last=False)
+                parsing = loading.result()
+                if parsing is None:
+                    break
+                # Страница загружена: следующая загружается, пока эта разбирается (и при parallel_pages=1)
+                fill(wait=False)
+                processed += 1
+                if not self._consume(page, parsing, start_year, end_year):
+                    break
+        finally:
+            self._pagination_done.set()
+            if pending:
+                self.logger.debug(f"Отброшены страницы, загруженные заранее: {', '.join(map(str, pending))}")
+            # Не ждём загрузок, которые уже идут (паузы ограничителя, таймаут страницы): их результат
+            # отбрасывается, а браузеры возвращаются в пул из DriverGroup.give_back
+            loaders.shutdown(wait=False, cancel_futures=True)
+        return processed
+
+    def _consume(self, page, parsing, start_year, end_year):
+        """Отбор и передача объявлений разобранной страницы; True — можно листать дальше"""
+        listings, has_next = parsing.result()
+        new_listings, all_known = self._process_page(page, listings, start_year, end_year)
+        if self._publish(page, new_listings):
+            return False
+        return has_next and not all_known
+
+    def _process_page(self, page, listings, start_year, end_year):
+        """Отбирает объявления страницы; возвращает (объявления, состоит ли страница только из известных)"""
+        selected = filter_listings(listings, start_year, end_year, page, self.logger, self.stop_event)
+        if self.seen is None:
+            return selected, False
+
+        ids = [listing.listing_id for listing in listings if listing.listing_id]
+        all_known = bool(ids) and all(self.seen.contains(listing_id) for listing_id in ids)
+        self.seen_this_run.update(ids)
+        self.seen.update(listings)
+        if all_known:
+            self.logger.info(f"Страница {page} состоит только из известных объявлений — дальше не листаем")
+            self.stopped_on_known = True
+        return selected, all_known
+
+    def _publish(self, page, listings, record=True):
+        """
+        Передаёт объявления страницы агрегатору (record=False — объявления не из выдачи этого запуска).
+        Возвращает True, если сбор пора остановить.
+        """
+        self.aggregator.put(self.site, page, listings, record)
+        return self.stop_event.is_set()
+
+    def _finish(self, start_year, end_year):
+        """Завершение сбора сайта: инкрементальный режим и (через агрегатор) передача неизрасходованной квоты"""
+        self._finish_incremental(start_year, end_year)
+        self.aggregator.finish(self.site)
+        if self.own_aggregator:
+            self.aggregator.close()
+
+    def _finish_incremental(self, start_year, end_year):
+        """Сохраняет известные объявления; при ранней остановке добавляет те, что не перепроверены сейчас"""
+        if self.seen is None:
+            return
+        if self.stopped_on_known and not self.stop_event.is_set():
+            retained = [Listing(self.site, *row) for row in self.seen.retained(self.seen_this_run, start_year, end_year)]
+            # Хранятся все объявления выдачи (по ним узнаются известные страницы), поэтому отбор — как у страниц
+            retained = filter_listings(retained, start_year, end_year, "известные", self.logger, self.stop_event)
+            if retained:
+                self.logger.info(f"Добавлено {len(retained)} ранее известных объявлений")
+                self._publish("известные", retained, record=False)
+        self.seen.save()
@@ -0,0 +1,500 @@
+import json
+import logging
+import re
+from collections import namedtuple
+
+from structured_log import sampled
+
+try:
+    import lxml.html
+    from lxml.cssselect import CSSSelector
+except ImportError:  # Без lxml остаётся эталонный движок на BeautifulSoup
+    lxml = None
+    CSSSelector = None
+
+MIN_PRICE = 100_000
+MAX_PRICE = 200_000_000
+
+# Объявление: сайт, ID на сайте, заголовок, год, цена, пробег (км) и город, если указаны
+Listing = namedtuple("Listing", ["source", "listing_id", "title", "year", "price", "mileage", "city"])
+
+MILEAGE_RE = re.compile(r'(\d[\d \xa0]*)\s*км')
+
+
+def _price_digits(text):
+    """Цена из текста: только цифры (пробелы, ₽ и "от" отбрасываются)"""
+    digits = "".join(filter(str.isdigit, text))
+    return int(digits) if digits else None
+
+
+def _read_auto_ru(title, year_text, price_text):
+    car_year = None
+    if year_text is not None:
+        try:
+            car_year = int(year_text)
+        except ValueError:
+            return None  # Ошибка парсинга года — объявление пропускается
+    price = None
+    if price_text is not None:
+        price_text = price_text.replace("₽", "").replace("\xa0", "").strip()
+        if price_text.startswith("от "):
+            price_text = price_text[3:]
+        try:
+            price = int(price_text)
+        except ValueError:
+            price = None
+    return title, car_year, price
+
+
+def _read_drom(title, year_text, price_text):
+    car_year = None
+    year_part = title.split(',')[-1].strip()
+    if year_part.isdigit() and len(year_part) == 4:
+        car_year = int(year_part)
+    price = _price_digits(price_text) if price_text is not None else None
+    return title, car_year, price
+
+
+def _read_avito(title, year_text, price_text):
+    title = title.replace("\xa0", " ")
+    year_match = re.search(r'\b(\d{4})\b', title)
+    if not year_match:
+        return None  # Объявление без года выпуска
+    price = _price_digits(price_text.split("₽")[0]) if price_text is not None else None
+    return title, int(year_match.group(1)), price
+
+
+def _listing_id(pattern, href):
+    """Стабильный ID объявления из ссылки; если ID не найден — сама ссылка без параметров"""
+    if not href:
+        return None
+    match = pattern.search(href)
+    return match.group(1) if match else href.split("?")[0]
+
+
+def _mileage(texts):
+    """Пробег из первого текста вида "33 598 км"; "2018, 20 265 км" -> 20265"""
+    for text in texts:
+        match = MILEAGE_RE.search(text)
+        if match:
+            return _price_digits(match.group(1))
+    return None
+
+
+def _avito_next_enabled(attrs):
+    return attrs.get("aria-disabled", "false") != "true" and "href" in attrs
+
+
+class SiteSpec:
+    """Селекторы и правила разбора объявлений одного сайта"""
+
+    def __init__(self, source, items, title, prices, next_page, read, link, id_pattern, mileage, city=None,
+                 year=None, next_enabled=None):
+        self.source = source
+        self.items = items
+        self.title = title
+        self.year = year
+        self.prices = prices  # Селекторы цены по приоритету, берётся первый найденный
+        self.next_page = next_page
+        self.read = read  # (title, year_text, price_text) -> (title, year, price) или None
+        self.link = link  # Ссылка на объявление
+        self.id_pattern = re.compile(id_pattern)  # ID объявления в ссылке
+        self.mileage = mileage  # Элементы, в одном из которых пробег ("... км")
+        self.city = city
+        self.next_enabled = next_enabled  # Проверка атрибутов кнопки "Следующая страница"
+
+
+SITES = {
+    "auto.ru": SiteSpec(
+        source="auto.ru",
+        items=".ListingItem",
+        title=".ListingItemTitle__link",
+        year=".ListingItem__year",
+        prices=[
+            ".ListingItemPrice__content a span",  # Обычная цена
+            ".ListingItemPrice_highlighted .ListingItemPrice__content",  # Выделенная цветом цена
+            ".ListingItemPrice_withPopup .ListingItemPrice__content a span",  # Цена от X до X
+        ],
+        next_page=".ListingPagination__next",
+        read=_read_auto_ru,
+        link=".ListingItemTitle__link",
+        id_pattern=r'/(\d+-[0-9a-f]+)/?(?:\?|$)',
+        mileage=".ListingItem__kmAge",
+        city=".MetroListPlace__regionName",
+    ),
+    "drom.ru": SiteSpec(
+        source="drom.ru",
+        items='[data-ftid="bulls-list_bull"]',
+        title='[data-ftid="bull_title"] h3',
+        prices=['[data-ftid="bull_price"]'],
+        next_page='[data-ftid="component_pagination-item-next"]',
+        read=_read_drom,
+        link="a[href]",
+        id_pattern=r'/(\d+)\.html',
+        mileage='[data-ftid="bull_description-item"]',
+        city='[data-ftid="bull_location"]',
+    ),
+    "avito.ru": SiteSpec(
+        source="avito.ru",
+        items=".iva-item-content-OWwoq",
+        title='p[itemprop="name"]',
+        prices=[".iva-item-priceStep-TIzu3"],
+        next_page='[data-marker="pagination-button/nextPage"]',
+        read=_read_avito,
+        link='a[data-marker="item-title"]',
+        id_pattern=r'_(\d+)(?:\?|$)',
+        mileage='p[itemprop="name"]',  # Пробег указан в заголовке
+        city='[class*="geo-root"] span',
+        next_enabled=_avito_next_enabled,
+    ),
+}
+
+
+class Bs4Extractor:
+    """Эталонная реализация на BeautifulSoup (html.parser) для сверки результатов"""
+
+    engine = "bs4"
+
+    def __init__(self, spec):
+        self.spec = spec
+
+    def extract(self, html):
+        """Возвращает ([Listing, ...], has_next) за один разбор страницы"""
+        from bs4 import BeautifulSoup  # Эталонный движок нужен редко — не платим за импорт при старте
+
+        spec = self.spec
+        soup = BeautifulSoup(html, "html.parser")
+        listings = []
+        for item in soup.select(spec.items):
+            title_tag = item.select_one(spec.title)
+            if not title_tag:
+                continue
+            year_tag = item.select_one(spec.year) if spec.year else None
+            price_text = None
+            for selector in spec.prices:
+                price_tag = item.select_one(selector)
+                if price_tag:
+                    price_text = price_tag.get_text(strip=True)
+                    break
+            listing = spec.read(
+                title_tag.get_text(strip=True),
+                year_tag.get_text(strip=True) if year_tag else None,
+                price_text,
+            )
+            if listing:
+                title, car_year, price = listing
+                link_tag = item.select_one(spec.link)
+                city_tag = item.select_one(spec.city) if spec.city else None
+                listings.append(Listing(
+                    spec.source,
+                    _listing_id(spec.id_pattern, link_tag.get("href") if link_tag else None),
+                    title, car_year, price,
+                    _mileage(tag.get_text(strip=True) for tag in item.select(spec.mileage)),
+                    city_tag.get_text(strip=True) if city_tag else None,
+                ))
+
+        next_tag = soup.select_one(spec.next_page)
+        has_next = next_tag is not None and (spec.next_enabled is None or spec.next_enabled(next_tag.attrs))
+        return listings, has_next
+
+
+def _text(element):
+    """Аналог get_text(strip=True) из BeautifulSoup"""
+    return "".join(part.strip() for part in element.itertext())
+
+
+class LxmlExtractor:
+    """Быстрый движок: парсер lxml (libxml2) и селекторы, скомпилированные один раз на сайт"""
+
+    engine = "lxml"
+
+    def __init__(self, spec):
+        self.spec = spec
+        self._items = CSSSelector(spec.items)
+        self._title = CSSSelector(spec.title)
+        self._year = CSSSelector(spec.year) if spec.year else None
+        self._prices = [CSSSelector(selector) for selector in spec.prices]
+        self._next = CSSSelector(spec.next_page)
+        self._link = CSSSelector(spec.link)
+        self._mileage = CSSSelector(spec.mileage)
+        self._city = CSSSelector(spec.city) if spec.city else None
+        self._parser = lxml.html.HTMLParser(encoding="utf-8")
+
+    def extract(self, html):
+        """Возвращает ([Listing, ...], has_next) за один разбор страницы"""
+        if isinstance(html, str):
+            html = html.encode("utf-8")
+        if not html.strip():
+            return [], False
+        root = lxml.html.fromstring(html, parser=self._parser)
+        spec = self.spec
+        listings = []
+        for item in self._items(root):
+            titles = self._title(item)
+            if not titles:
+                continue
+            years = self._year(item) if self._year is not None else None
+            price_text = None
+            for selector in self._prices:
+                found = selector(item)
+                if found:
+                    price_text = _text(found[0])
+                    break
+            listing = spec.read(_text(titles[0]), _text(years[0]) if years else None, price_text)
+            if listing:
+                title, car_year, price = listing
+                links = self._link(item)
+                cities = self._city(item) if self._city is not None else None
+                listings.append(Listing(
+                    spec.source,
+                    _listing_id(spec.id_pattern, links[0].get("href") if links else None),
+                    title, car_year, price,
+                    _mileage(_text(element) for element in self._mileage(item)),
+                    _text(cities[0]) if cities else None,
+                ))
+
+        next_tags = self._next(root)
+        has_next = bool(next_tags) and (
+                spec.next_enabled is None or spec.next_enabled(dict(next_tags[0].attrib)))
+        return listings, has_next
+
+
+def _find_state(html, markers):
+    """
+    Встроенное состояние страницы: JSON сразу после первого найденного маркера
+    (например, 'window.__INITIAL_STATE__ =' или '<script id="initial-state"...>'); None — не найдено.
+    """
+    for marker in markers:
+        position = html.find(marker)
+        if position < 0:
+            continue
+        start = html.find("{", position + len(marker))
+        if start < 0:
+            continue
+        try:
+            state, _ = json.JSONDecoder().raw_decode(html, start)
+            return state
+        except ValueError:
+            continue
+    return None
+
+
+def _path(data, *keys):
+    """data[key1][key2]...; None, если по пути чего-то нет"""
+    for key in keys:
+        if isinstance(data, dict):
+            data = data.get(key)
+        elif isinstance(data, list) and isinstance(key, int) and -len(data) <= key < len(data):
+            data = data[key]
+        else:
+            return None
+    return data
+
+
+def _number(value):
+    """Число из значения состояния: 950000, "950000", "950 000 ₽" -> 950000"""
+    if isinstance(value, bool) or value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    return _price_digits(str(value))
+
+
+def _find_container(data, key, depth=6):
+    """Первый словарь, в котором под ключом key список, на глубине до depth"""
+    if depth < 0:
+        return None
+    if isinstance(data, dict):
+        if isinstance(data.get(key), list):
+            return data
+        values = data.values()
+    elif isinstance(data, list):
+        values = data
+    else:
+        return None
+    for value in values:
+        if isinstance(value, (dict, list)):
+            found = _find_container(value, key, depth - 1)
+            if found is not None:
+                return found
+    return None
+
+
+def _state_auto_ru(state):
+    """Объявления из состояния auto.ru (listing.data.offers, как в ответе API поиска)"""
+    data = _path(state, "listing", "data")
+    offers = _path(data, "offers")
+    if not isinstance(offers, list):
+        return None
+    listings = []
+    for offer in offers:
+        if not isinstance(offer, dict):
+            continue
+        vehicle = offer.get("vehicle_info") or {}
+        title = " ".join(filter(None, (_path(vehicle, "mark_info", "name"), _path(vehicle, "model_info", "name"))))
+        offer_id, offer_hash = offer.get("id"), offer.get("hash")
+        listings.append(Listing(
+            "auto.ru",
+            f"{offer_id}-{offer_hash}" if offer_id and offer_hash else offer_id,
+            title,
+            _number(_path(offer, "documents", "year")),
+            _number(_path(offer, "price_info", "RUR") or _path(offer, "price_info", "price")),
+            _number(_path(offer, "state", "mileage")),
+            _path(offer, "seller", "location", "region_info", "name"),
+        ))
+    current = _number(_path(data, "pagination", "current"))
+    total = _number(_path(data, "pagination", "total_page_count"))
+    return listings, bool(current and total and current < total)
+
+
+def _state_drom(state):
+    """Объявления из состояния drom.ru (список bulls; поля id/bullId, title, year, price, mileage, city)"""
+    container = _find_container(state, "bulls")
+    if container is None:
+        return None
+    bulls = container["bulls"]
+    listings = []
+    for bull in bulls:
+        if not isinstance(bull, dict):
+            continue
+        title = bull.get("title") or ""
+        year = _number(bull.get("year"))
+        if year is None:
+            year = _read_drom(title, None, None)[1]
+        city = bull.get("city") or bull.get("cityName") or _path(bull, "location", "name")
+        bull_id = bull.get("bullId") or bull.get("id")
+        listings.append(Listing(
+            "drom.ru", str(bull_id) if bull_id else None, title, year,
+            _number(bull.get("price")), _number(bull.get("mileage")), city,
+        ))
+    # Пагинация лежит рядом со списком (например, в props.pageProps), а не обязательно в корне
+    pagination = container.get("pagination")
+    if not isinstance(pagination, dict):
+        pagination = _path(state, "pagination")
+    has_next = isinstance(pagination, dict) and bool(pagination.get("nextPage") or pagination.get("hasNext"))
+    return listings, has_next
+
+
+def _state_complete(listings):
+    """
+    Поля состояния прочитаны: у всех объявлений есть название и год, хотя бы у одного — цена
+    (объявления без цены бывают и на настоящей выдаче). Иначе структура не та, что ожидается.
+    """
+    return (bool(listings) and all(listing.title and listing.year for listing in listings)
+            and any(listing.price for listing in listings))
+
+
+class StateSpec:
+    """Где на странице встроенное состояние и как получить из него ([Listing, ...], has_next)"""
+
+    def __init__(self, markers, read):
+        self.markers = markers
+        self.read = read  # state -> ([Listing, ...], has_next) или None, если структура не та
+
+
+STATES = {
+    "auto.ru": StateSpec(['<script id="initial-state"', "window.__INITIAL_STATE__"], _state_auto_ru),
+    "drom.ru": StateSpec(["window.__preloaded_state__", "window.__INITIAL_STATE__", '<script id="__NEXT_DATA__"'],
+                         _state_drom),
+}
+
+
+class StateExtractor:
+    """
+    Объявления из встроенного в страницу состояния (JSON, из которого сайт рендерит выдачу):
+    готовые поля без CSS-селекторов и разбора всего DOM. Работает и с page_source, и с ответом
+    обычного HTTP-запроса. Если состояния нет или его структура изменилась (не читаются
+    название, год или цены) — разбор DOM.
+    """
+
+    engine = "state"
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.state_spec = STATES.get(spec.source)
+        self.fallback = ENGINES[DOM_ENGINE](spec)
+        self.from_state = 0  # Страниц, разобранных по состоянию
+        self.from_dom = 0  # Страниц, разобранных по DOM
+
+    def extract(self, html):
+        """Возвращает ([Listing, ...], has_next)"""
+        if self.state_spec is not None:
+            text = html.decode("utf-8", errors="replace") if isinstance(html, bytes) else html
+            state = _find_state(text, self.state_spec.markers)
+            result = self.state_spec.read(state) if state is not None else None
+            if result and _state_complete(result[0]):
+                self.from_state += 1
+                return result
+            logging.debug(f"{self.spec.source}: встроенное состояние не найдено или не разобрано — разбираем DOM")
+        self.from_dom += 1
+        return self.fallback.extract(html)
+
+
+ENGINES = {"bs4": Bs4Extractor}
+if lxml is not None:
+    ENGINES["lxml"] = LxmlExtractor
+
+DOM_ENGINE = "lxml" if lxml is not None else "bs4"  # Движок разбора DOM (и запасной путь для "state")
+ENGINES["state"] = StateExtractor
+DEFAULT_ENGINE = DOM_ENGINE  # "state" — только явно (--engine state), пока не сверен с живыми страницами
+
+_extractors = {}
+
+
+def get_extractor(site, engine=None):
+    """Экстрактор объявлений для сайта; экземпляры (и скомпилированные селекторы) переиспользуются"""
+    engine = engine or DEFAULT_ENGINE
+    key = (site, engine)
+    if key not in _extractors:
+        _extractors[key] = ENGINES[engine](SITES[site])
+    return _extractors[key]
+
+
+def set_default_engine(engine):
+    """Движок парсеров процесса (main.py/service.py --engine); в пул разбора передаётся явно"""
+    global DEFAULT_ENGINE
+    if engine not in ENGINES:
+        raise ValueError(f"Неизвестный движок разбора: {engine}")
+    DEFAULT_ENGINE = engine
+
+
+def filter_listings(listings, start_year, end_year, page, logger, stop_event=None):
+    """Отбирает объявления подходящего года и с ценой в разумном диапазоне"""
+    selected = []
+    # События по объявлениям пишутся выборочно (structured_log.SAMPLE_EVERY) и форматируются лениво
+    debug = logger.isEnabledFor(logging.DEBUG)
+    for listing in listings:
+        if stop_event is not None and stop_event.is_set():  # Проверяем флаг остановки перед каждым объявлением
+            break
+        title, car_year, price = listing.title, listing.year, listing.price
+        if car_year and start_year and end_year and not (start_year <= car_year <= end_year):
+            if debug and sampled("listing"):
+                logger.debug("Страница %s: %s, год %s вне диапазона", page, title, car_year,
+                             extra=_listing_event(page, listing, "year_out_of_range"))
+            continue
+        if price and MIN_PRICE <= price <= MAX_PRICE:
+            selected.append(listing)
+            if debug and sampled("listing"):
+                logger.debug("Страница %s: %s, Год %s, Цена %s добавлена", page, title, car_year, price,
+                             extra=_listing_event(page, listing, "accepted"))
+        elif debug and sampled("listing"):
+            logger.debug("Страница %s: %s, Цена %s вне диапазона", page, title, price or "не указана",
+                         extra=_listing_event(page, listing, "price_out_of_range"))
+    return selected
+
+
+def _listing_event(page, listing, decision):
+    """Поля события по объявлению для структурированного журнала"""
+    return {"event": "listing", "fields": {"page": page, "source": listing.source, "listing_id": listing.listing_id,
+                                           "year": listing.year, "price": listing.price, "decision": decision}}
+
+
+def filter_prices(listings, start_year, end_year, page, logger, stop_event=None):
+    """Цены объявлений подходящего года и разумного диапазона"""
+    return [listing.price for listing in filter_listings(listings, start_year, end_year, page, logger, stop_event)]
+
+
+def extract_prices(site, html, start_year=None, end_year=None, engine=None, logger=None):
+    """Разбор сохранённой страницы без парсера и сети: (цены, есть ли следующая страница)"""
+    listings, has_next = get_extractor(site, engine).extract(html)
+    return filter_prices(listings, start_year, end_year, None, logger or logging.getLogger(__name__)), has_next
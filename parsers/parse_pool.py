@@ -0,0 +1,106 @@
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from metrics import get_metrics
+from .extractors import Listing, get_extractor
+
+
+def extract_page(site, engine, html):
+    """
+    Выполняется в процессе пула: разбор страницы -> (объявления простыми кортежами, has_next, секунд).
+    Движок передаётся явно: процессы запущены через spawn и не видят настроек родителя.
+    """
+    start = time.perf_counter()
+    listings, has_next = get_extractor(site, engine).extract(html)
+    return [tuple(listing) for listing in listings], has_next, time.perf_counter() - start
+
+
+def _extract_timed(site, engine, html):
+    """Разбор в вызывающем потоке с замером времени экстрактора"""
+    with get_metrics().timer("extract", site):
+        return get_extractor(site, engine).extract(html)
+
+
+class ParsePool:
+    """
+    Разбор страниц в отдельных процессах: разбор не конкурирует за GIL с потоками браузеров
+    и масштабируется по ядрам. workers=0 — разбор в вызывающем потоке, как раньше.
+    """
+
+    def __init__(self, workers=None):
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn: дочерние процессы не наследуют потоки и блокировки родителя
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context("spawn"))
+            return self._executor
+
+    def submit(self, site, engine, html):
+        """Future с ([Listing, ...], has_next): разбор страницы сайта движком engine"""
+        result = Future()
+        if not self.workers:
+            try:
+                result.set_result(_extract_timed(site, engine, html))
+            except Exception as e:
+                result.set_exception(e)
+            return result
+
+        def done(future):
+            try:
+                listings, has_next, seconds = future.result()
+                get_metrics().observe("extract", seconds, site)
+                result.set_result(([Listing(*listing) for listing in listings], has_next))
+            except Exception as e:
+                # Пул сломан (процесс упал) — разбираем здесь же, чтобы не потерять страницу
+                logging.warning(f"Разбор страницы {site} в пуле процессов не удался ({e}), разбираем в потоке")
+                try:
+                    result.set_result(_extract_timed(site, engine, html))
+                except Exception as inline_error:
+                    result.set_exception(inline_error)
+
+        data = html.encode("utf-8") if isinstance(html, str) else html
+        executor = self._get_executor()
+        try:
+            future = executor.submit(extract_page, site, engine, data)
+        except BrokenProcessPool:
+            # Один из процессов упал — пул непригоден, запускаем новый
+            logging.warning("Пул процессов разбора сломан, перезапускаю")
+            self._reset(executor)
+            future = self._get_executor().submit(extract_page, site, engine, data)
+        future.add_done_callback(done)
+        return result
+
+    def _reset(self, executor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_parse_pool():
+    """Общий пул разбора страниц процесса"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ParsePool()
+        return _pool
@@ -0,0 +1,211 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from http_sessions import get_session_manager
+
+# Файл с прокси
+PROXY_FILE = "proxies.txt"
+
+PROXY_TEST_URL = "http://httpbin.org/ip"
+
+
+def proxy_to_url(proxy):
+    """Преобразует прокси "ip:port@login:password" в URL вида http://login:password@ip:port"""
+    host_port, auth = proxy.split('@')
+    username, password = auth.split(':')
+    return f"http://{username}:{password}@{host_port}"
+
+
+def is_proxy_working(proxy_url, test_url=PROXY_TEST_URL, timeout=5):
+    """Проверяет работоспособность одного прокси (повторные проверки идут по открытому соединению)"""
+    try:
+        response = get_session_manager().get(test_url, proxy_url, timeout=timeout)
+        return response.status_code == 200
+    except Exception:
+        return False
+
+
+class ProxyState:
+    """Состояние и статистика одного прокси в пуле"""
+
+    __slots__ = ("proxy", "host_port", "proxy_url", "latency", "successes", "failures",
+                 "consecutive_failures", "checked_at", "healthy")
+
+    def __init__(self, proxy):
+        self.proxy = proxy
+        self.host_port = proxy.split('@')[0]
+        self.proxy_url = proxy_to_url(proxy)
+        self.latency = None  # Скользящее среднее времени ответа, сек
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.checked_at = 0.0
+        self.healthy = False
+
+    @property
+    def score(self):
+        """Чем выше, тем лучше: доля успехов, делённая на задержку"""
+        total = self.successes + self.failures
+        success_rate = (self.successes + 1) / (total + 2)
+        return success_rate / max(self.latency or 1.0, 0.05)
+
+    def record(self, ok, latency=None):
+        self.checked_at = time.monotonic()
+        if ok:
+            self.successes += 1
+            self.consecutive_failures = 0
+            self.healthy = True
+            if latency is not None:
+                # Экспоненциальное сглаживание задержки
+                self.latency = latency if self.latency is None else 0.7 * self.latency + 0.3 * latency
+        else:
+            self.failures += 1
+            self.consecutive_failures += 1
+            self.healthy = False
+
+
+class ProxyPool:
+    """
+    Долгоживущий пул прокси: файл читается один раз, кандидаты проверяются параллельно
+    в фоновом потоке, здоровые прокси ранжируются по задержке и доле успехов.
+    get() возвращает лучший здоровый прокси за O(1) (рейтинг пересчитывается при изменениях).
+    """
+
+    def __init__(self, proxy_file=PROXY_FILE, check_ttl=300, max_failures=3, workers=8,
+                 test_url=PROXY_TEST_URL, timeout=5):
+        self.proxy_file = proxy_file
+        self.check_ttl = check_ttl  # Через сколько секунд перепроверять прокси
+        self.max_failures = max_failures  # После скольких неудач подряд прокси удаляется из пула
+        self.workers = workers
+        self.test_url = test_url
+        self.timeout = timeout
+        self._states = {}
+        self._best = None
+        self._lock = threading.Lock()
+        self._ready = threading.Event()  # Первая проверка дала результат
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Загружает прокси из файла и запускает фоновую проверку (однократно)"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._load()
+            self._thread = threading.Thread(target=self._check_loop, name="proxy-pool", daemon=True)
+        if not self._states:
+            self._ready.set()
+            return
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _load(self):
+        try:
+            with open(self.proxy_file, "r") as f:
+                proxies = [line.strip() for line in f if line.strip()]
+        except FileNotFoundError:
+            logging.warning(f"Файл {self.proxy_file} не найден — работа будет вестись с собственным IP")
+            return
+
+        if not proxies:
+            logging.warning(f"Файл {self.proxy_file} пуст — работа будет вестись с собственным IP")
+            return
+
+        for proxy in proxies:
+            try:
+                self._states[proxy] = ProxyState(proxy)
+            except ValueError:
+                logging.warning(f"Некорректная строка прокси пропущена: {proxy}")
+        logging.info(f"Загружено {len(self._states)} прокси из файла {self.proxy_file}")
+
+    def _check_one(self, state):
+        start = time.monotonic()
+        ok = is_proxy_working(state.proxy_url, test_url=self.test_url, timeout=self.timeout)
+        self._record(state.proxy, ok, time.monotonic() - start)
+        if ok:
+            self._ready.set()
+
+    def _check_loop(self):
+        logging.info("Начало фоновой проверки прокси...")
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="proxy-check") as executor:
+            while not self._stop.is_set():
+                now = time.monotonic()
+                with self._lock:
+                    due = [s for s in self._states.values() if now - s.checked_at >= self.check_ttl]
+                if due:
+                    list(executor.map(self._check_one, due))
+                    with self._lock:
+                        healthy = sum(1 for s in self._states.values() if s.healthy)
+                        total = len(self._states)
+                    logging.info(f"Проверка прокси завершена: рабочих {healthy} из {total}")
+                self._ready.set()
+                if not self._states:
+                    logging.warning("В пуле не осталось прокси — работа будет вестись с собственным IP")
+                    return
+                self._stop.wait(max(1.0, self.check_ttl / 10))
+
+    def _record(self, proxy, ok, latency=None):
+        with self._lock:
+            state = self._states.get(proxy)
+            if state is None:
+                return
+            state.record(ok, latency)
+            if not ok and state.consecutive_failures >= self.max_failures:
+                del self._states[proxy]
+                logging.warning(f"Прокси {state.host_port} удалён из пула после {state.consecutive_failures} неудач подряд")
+            self._rerank()
+
+    def _rerank(self):
+        healthy = [s for s in self._states.values() if s.healthy]
+        self._best = max(healthy, key=lambda s: s.score).proxy if healthy else None
+
+    def get(self, wait=30):
+        """
+        Возвращает лучший здоровый прокси в формате "ip:port@login:password" или None.
+        При первом обращении ждёт не дольше wait секунд, пока проверка не найдёт рабочий прокси.
+        """
+        self.start()
+        if not self._ready.is_set():
+            self._ready.wait(wait)
+        return self._best
+
+    def report_success(self, proxy, latency=None):
+        """Отмечает успешный запрос через прокси"""
+        if proxy:
+            self._record(proxy, True, latency)
+
+    def report_failure(self, proxy):
+        """Отмечает отказ прокси (ошибка соединения, таймаут); 429 и капча сюда не относятся"""
+        if proxy:
+            self._record(proxy, False)
+
+    def snapshot(self):
+        """Текущее состояние пула для логов и отладки"""
+        with self._lock:
+            return [
+                {
+                    "proxy": s.host_port,
+                    "healthy": s.healthy,
+                    "latency": round(s.latency, 3) if s.latency is not None else None,
+                    "successes": s.successes,
+                    "failures": s.failures,
+                }
+                for s in self._states.values()
+            ]
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_proxy_pool():
+    """Общий на процесс пул прокси"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProxyPool()
+        return _pool
@@ -0,0 +1,109 @@
+import logging
+import math
+import threading
+
+
+class QuotaScheduler:
+    """
+    Делит общий лимит цен между сайтами, чтобы выборка не состояла из одного, самого быстрого сайта.
+
+    Квота работающего сайта = (лимит - собранное закончившими сайтами) * вес сайта / сумма весов
+    работающих сайтов.
+    Вес — статический (weights) или, в режиме "yield", число принятых объявлений на страницу
+    (у сайта, ещё не приславшего страниц, — средний выход остальных).
+    Сайт, выбравший свою квоту, ждёт перед следующей страницей: когда другой сайт заканчивается
+    (кончилась выдача или ошибка), его неизрасходованная квота перераспределяется между остальными.
+    """
+
+    def __init__(self, limit, sources, weights=None, mode="yield", stop_event=None):
+        self.limit = limit
+        self.mode = mode
+        self.stop_event = stop_event
+        self.weights = {source: (weights or {}).get(source, 1.0) for source in sources}
+        self.collected = {source: 0 for source in sources}
+        self.pages = {source: 0 for source in sources}
+        self.offered = {source: 0 for source in sources}  # Подходящих объявлений со страниц, до обрезки квотой
+        self.active = set(sources)
+        self.quotas = {}
+        self._cond = threading.Condition()
+        with self._cond:
+            self._rebalance()
+
+    def _yield(self, source):
+        # Средний выход страницы; сайт без подходящих объявлений получает минимальный вес
+        return max(self.offered[source] / self.pages[source], 0.1)
+
+    def _weight(self, source):
+        if self.mode != "yield":
+            return self.weights[source]
+        if self.pages[source]:
+            return self._yield(source) * self.weights[source]
+        # Сайт ещё не прислал страниц: средний выход остальных, иначе первый же быстрый сайт забирает всё
+        observed = [self._yield(other) for other in self.active if self.pages[other]]
+        return (sum(observed) / len(observed) if observed else 1.0) * self.weights[source]
+
+    def _rebalance(self):
+        # Работающие сайты делят весь лимит без собранного закончившими: уже собранное быстрым
+        # сайтом не увеличивает его долю
+        pool = max(self.limit - sum(self.collected[source] for source in self.collected
+                                    if source not in self.active), 0)
+        total_weight = sum(self._weight(source) for source in self.active)
+        for source in self.collected:
+            if source in self.active and total_weight:
+                self.quotas[source] = pool * self._weight(source) / total_weight
+            else:
+                self.quotas[source] = self.collected[source]
+        self._cond.notify_all()
+
+    @property
+    def done(self):
+        """Лимит набран или все сайты закончили"""
+        return sum(self.collected.values()) >= self.limit or not self.active or (
+            self.stop_event is not None and self.stop_event.is_set())
+
+    def wait_for_quota(self, source, poll=1.0):
+        """Перед загрузкой страницы: ждёт, пока у сайта есть квота; False — сайту пора заканчивать"""
+        with self._cond:
+            while not self.done and self.collected[source] >= self.quotas[source]:
+                self._cond.wait(poll)
+            return not self.done
+
+    def has_quota(self, source):
+        """То же без ожидания: есть ли у сайта квота прямо сейчас"""
+        with self._cond:
+            return not self.done and self.collected[source] < self.quotas[source]
+
+    def take(self, source, listings):
+        """Принимает объявления страницы в пределах квоты сайта; возвращает принятые"""
+        with self._cond:
+            room = max(math.ceil(self.quotas[source] - self.collected[source]), 0)
+            room = min(room, max(self.limit - sum(self.collected.values()), 0))  # Сумма квот может сместиться
+            accepted = listings[:room]
+            self.collected[source] += len(accepted)
+            self.offered[source] += len(listings)
+            self.pages[source] += 1
+            self._rebalance()
+            if self.done and self.stop_event is not None:
+                self.stop_event.set()
+        if len(accepted) < len(listings):
+            logging.debug(f"{source}: квота выбрана, отброшено {len(listings) - len(accepted)} объявлений")
+        return accepted
+
+    def finish(self, source):
+        """Сайт закончил работу; его оставшаяся квота делится между остальными"""
+        with self._cond:
+            if source not in self.active:
+                return
+            self.active.discard(source)
+            self._rebalance()
+            if self.done and self.stop_event is not None:
+                self.stop_event.set()
+        logging.info(f"{source}: сбор завершён ({self.collected[source]} цен), квота перераспределена")
+
+    def stats(self):
+        with self._cond:
+            return {
+                source: {"collected": self.collected[source], "pages": self.pages[source],
+                         "quota": round(self.quotas[source])}
+                for source in self.collected
+            }
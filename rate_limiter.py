@@ -0,0 +1,181 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+from metrics import get_metrics, site_of
+
+# Начальная частота запросов, запросов/сек: через прокси и с собственного IP (его легко заблокировать)
+START_RATE = {True: 0.5, False: 0.1}
+# Сайты, которые строже к частым запросам
+DOMAIN_START_RATE = {"avito.ru": {True: 0.5, False: 0.04}}
+MIN_RATE = 1 / 60
+MAX_RATE = 2.0
+INCREASE = 0.05  # Аддитивный рост частоты после успешного быстрого ответа
+DECREASE = 0.5  # Мультипликативное снижение при 429 или капче
+SLOW_DECREASE = 0.8  # Снижение, если ответ заметно медленнее обычного
+COOLDOWN = 15.0  # Пауза после 429/капчи, сек; растёт с каждым отказом подряд
+MAX_COOLDOWN = 300.0
+JITTER = 0.25  # Случайная добавка к интервалу (доля), чтобы запросы не шли ровной сеткой
+
+CAPTCHA_MARKERS = ("captcha", "showcaptcha", "firewall")
+
+
+def domain_of(url):
+    """Домен без www.: https://www.avito.ru/... -> avito.ru"""
+    return urlparse(url).netloc.removeprefix("www.")
+
+
+def looks_like_captcha(url, text=None):
+    """Признаки капчи или антибот-заглушки в адресе (после редиректа) или начале страницы"""
+    haystack = (url or "").lower() + " " + (text or "")[:5000].lower()
+    return any(marker in haystack for marker in CAPTCHA_MARKERS)
+
+
+class TokenBucket:
+    """
+    Корзина токенов одного (домена, выхода): rate токенов в секунду, не больше burst подряд.
+    Частота подстраивается по AIMD: после успешного ответа растёт на INCREASE, при 429/капче
+    падает вдвое с паузой COOLDOWN (удваивается при отказах подряд), при медленных ответах —
+    в SLOW_DECREASE раз.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.latency = None  # Скользящее среднее времени ответа, сек
+        self.successes = 0
+        self.throttles = 0
+        self.consecutive_throttles = 0
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self):
+        """Занимает токен; возвращает, сколько секунд подождать перед запросом"""
+        now = time.monotonic()
+        self._refill(now)
+        self.tokens -= 1
+        wait = max(-self.tokens / self.rate, self.blocked_until - now, 0)
+        if wait:
+            wait += random.uniform(0, JITTER / self.rate)
+        return wait
+
+    def success(self, latency=None):
+        self.successes += 1
+        self.consecutive_throttles = 0
+        if latency is not None and self.latency is not None and latency > max(2 * self.latency, 1.0):
+            self.rate = max(self.rate * SLOW_DECREASE, MIN_RATE)  # Сайт отвечает медленнее — не давим
+        else:
+            self.rate = min(self.rate + INCREASE, MAX_RATE)
+        if latency is not None:
+            self.latency = latency if self.latency is None else self.latency * 0.8 + latency * 0.2
+
+    def throttle(self, retry_after=None):
+        self.throttles += 1
+        self.consecutive_throttles += 1
+        self.rate = max(self.rate * DECREASE, MIN_RATE)
+        cooldown = retry_after or min(COOLDOWN * 2 ** (self.consecutive_throttles - 1), MAX_COOLDOWN)
+        self.blocked_until = max(self.blocked_until, time.monotonic() + cooldown)
+        # Следующий токен — в конце паузы: запросы, вставшие в очередь во время паузы,
+        # идут после неё со сниженной частотой, а не все разом
+        self.tokens = 1
+        self.updated = self.blocked_until
+        return cooldown
+
+
+class RateLimiter:
+    """
+    Ограничитель частоты запросов, общий для всех путей загрузки (Selenium, requests, AsyncFetcher):
+    своя корзина на каждую пару (домен, прокси) — у каждого выхода свой IP и свои лимиты сайта.
+    Перед запросом — acquire (или acquire_async), после — success / throttle.
+    """
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, url, proxy):
+        domain = domain_of(url)
+        key = (domain, proxy)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            start = DOMAIN_START_RATE.get(domain, START_RATE)[proxy is not None]
+            bucket = self._buckets[key] = TokenBucket(start)
+        return bucket
+
+    def reserve(self, url, proxy=None):
+        """Сколько секунд подождать перед запросом к url через proxy (токен уже занят)"""
+        with self._lock:
+            return self._bucket(url, proxy).reserve()
+
+    def acquire(self, url, proxy=None):
+        wait = self.reserve(url, proxy)
+        if wait:
+            logging.debug(f"Пауза перед запросом к {domain_of(url)}: {wait:.2f} сек.")
+            time.sleep(wait)
+            get_metrics().observe("rate_limit_wait", wait, site_of(url))
+
+    async def acquire_async(self, url, proxy=None):
+        wait = self.reserve(url, proxy)
+        if wait:
+            logging.debug(f"Пауза перед запросом к {domain_of(url)}: {wait:.2f} сек.")
+            await asyncio.sleep(wait)
+            get_metrics().observe("rate_limit_wait", wait, site_of(url))
+
+    def success(self, url, proxy=None, latency=None):
+        with self._lock:
+            self._bucket(url, proxy).success(latency)
+
+    def throttle(self, url, proxy=None, retry_after=None, reason="429"):
+        """Сайт ограничил нас (429, капча): частота снижается, выход ставится на паузу"""
+        with self._lock:
+            bucket = self._bucket(url, proxy)
+            cooldown = bucket.throttle(retry_after)
+            rate = bucket.rate
+        logging.warning(f"{domain_of(url)} через {proxy.split('@')[0] if proxy else 'собственный IP'}: {reason}, "
+                        f"частота снижена до {rate:.3f} запр/сек, пауза {cooldown:.0f} сек.")
+
+    def rates(self):
+        """Текущие частоты по доменам и выходам"""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                f"{domain} через {proxy.split('@')[0] if proxy else 'собственный IP'}": {
+                    "rate": round(bucket.rate, 3),
+                    "interval_sec": round(1 / bucket.rate, 2),
+                    "latency": round(bucket.latency, 2) if bucket.latency is not None else None,
+                    "successes": bucket.successes,
+                    "throttles": bucket.throttles,
+                    "paused_sec": round(max(bucket.blocked_until - now, 0), 1),
+                }
+                for (domain, proxy), bucket in self._buckets.items()
+            }
+
+
+def retry_after_seconds(response):
+    """Retry-After ответа в секундах (только числовая форма) или None"""
+    value = getattr(response, "headers", {}).get("Retry-After")
+    try:
+        return min(float(value), MAX_COOLDOWN) if value else None
+    except ValueError:
+        return None
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """Общий на процесс ограничитель частоты запросов"""
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = RateLimiter()
+        return _limiter
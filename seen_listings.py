@@ -0,0 +1,73 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+STATE_DIR = "state"
+
+
+class SeenListings:
+    """
+    Известные объявления одного запроса (сайт, марка, модель, годы), сохраняются между запусками.
+    Для каждого объявления хранятся год, последняя цена, пробег, город и время, когда оно встречалось в выдаче.
+    """
+
+    def __init__(self, site, make, model, years, state_dir=STATE_DIR, retain_days=14):
+        self.retain_days = retain_days  # Сколько дней цена неперепроверенного объявления считается актуальной
+        name = "_".join([site, make, model] + [str(year) for year in years or []])
+        name = re.sub(r'[^a-zA-Z0-9]', '_', name.lower())
+        self.path = os.path.join(state_dir, f"{name}.json")
+        self._lock = threading.Lock()
+        self._listings = {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self._listings = json.load(f)
+            logging.info(f"Загружено {len(self._listings)} известных объявлений из {self.path}")
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logging.warning(f"Не удалось прочитать {self.path}: {e}")
+
+    def __len__(self):
+        return len(self._listings)
+
+    def contains(self, listing_id):
+        return listing_id in self._listings
+
+    def update(self, listings):
+        """Запоминает объявления страницы (Listing)"""
+        now = time.time()
+        with self._lock:
+            for listing in listings:
+                if listing.listing_id:
+                    self._listings[listing.listing_id] = [listing.title, listing.year, listing.price,
+                                                          listing.mileage, listing.city, now]
+
+    def retained(self, exclude, start_year=None, end_year=None):
+        """Известные объявления, не встреченные в этом запуске, но ещё не устаревшие:
+        [(listing_id, title, year, price, mileage, city), ...]"""
+        border = time.time() - self.retain_days * 86400
+        listings = []
+        with self._lock:
+            for listing_id, (title, car_year, price, mileage, city, seen_at) in self._listings.items():
+                if listing_id in exclude or seen_at < border or not price:
+                    continue
+                if car_year and start_year and end_year and not (start_year <= car_year <= end_year):
+                    continue
+                listings.append((listing_id, title, car_year, price, mileage, city))
+        return listings
+
+    def save(self):
+        """Сохраняет известные объявления, удаляя устаревшие"""
+        border = time.time() - self.retain_days * 86400
+        with self._lock:
+            self._listings = {key: value for key, value in self._listings.items() if value[-1] >= border}
+            data = dict(self._listings)
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+        except OSError as e:
+            logging.warning(f"Не удалось сохранить {self.path}: {e}")
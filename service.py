@@ -0,0 +1,217 @@
+import argparse
+import json
+import logging
+import threading
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from batch import parse_year
+from driver_pool import get_driver_pool
+from main import run_query, validate_limit
+from http_sessions import get_session_manager
+from metrics import get_metrics
+from page_cache import get_page_cache
+from parsers.extractors import DEFAULT_ENGINE, ENGINES, set_default_engine
+from proxy_pool import get_proxy_pool
+from rate_limiter import get_rate_limiter
+from site_archive import get_recorder, set_replay_base
+from utils import setup_logging
+
+
+class ValuationService:
+    """
+    Держит браузеры, пул прокси и кэш прогретыми между запросами и объединяет одинаковые
+    одновременные запросы (make, model, years, limit): выполняется один парсинг,
+    результат получают все ожидающие.
+    """
+
+    def __init__(self, workers=2, use_proxy=True):
+        self.use_proxy = use_proxy
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="valuation")
+        self._inflight = {}  # ключ запроса -> Future
+        self._progress = {}  # ключ запроса -> промежуточная оценка идущего парсинга
+        self._lock = threading.Lock()
+        self.queued = 0  # Ждут свободного исполнителя
+        self.running = 0  # Парсинг идёт прямо сейчас
+        self.coalesced = 0  # Запросов, присоединившихся к уже идущему парсингу
+        self.completed = 0
+        self.failed = 0
+
+    @staticmethod
+    def key(make, model, year, limit):
+        return make.lower(), model.lower(), tuple(year or ()), limit
+
+    def _run(self, make, model, year, limit):
+        key = self.key(make, model, year, limit)
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+        try:
+            return run_query(make, model, year, limit, use_proxy=self.use_proxy,
+                             on_progress=lambda progress: self._progress.__setitem__(key, progress))
+        finally:
+            with self._lock:
+                self.running -= 1
+                self._progress.pop(key, None)
+
+    def _done(self, key, future):
+        with self._lock:
+            self._inflight.pop(key, None)
+            if future.exception() is None:
+                self.completed += 1
+            else:
+                self.failed += 1
+
+    def submit(self, make, model, year, limit):
+        """Future с результатом оценки; одинаковые одновременные запросы получают общий Future"""
+        key = self.key(make, model, year, limit)
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                logging.info(f"Запрос {key} присоединён к уже идущему парсингу")
+                return future
+            self.queued += 1
+            future = self._executor.submit(self._run, make, model, year, limit)
+            self._inflight[key] = future
+        future.add_done_callback(lambda f: self._done(key, f))
+        return future
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                "queue_depth": self.queued,
+                "in_flight_crawls": self.running,
+                "distinct_requests": len(self._inflight),
+                "coalesced": self.coalesced,
+                "completed": self.completed,
+                "failed": self.failed,
+                # Промежуточные оценки идущих парсингов
+                "in_progress": {" ".join(map(str, key)): progress for key, progress in self._progress.items()},
+            }
+        cache = get_page_cache()
+        stats["driver_pool"] = get_driver_pool().stats()
+        stats["page_cache"] = {"hits": cache.hits, "misses": cache.misses}
+        stats["rate_limits"] = get_rate_limiter().rates()
+        stats["http_sessions"] = get_session_manager().stats()
+        return stats
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    service = None
+    timeout_sec = 1800
+
+    def _send_json(self, status, data):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_text(self, status, text, content_type="text/plain; charset=utf-8"):
+        body = text.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        params = urllib.parse.parse_qs(url.query)
+
+        if url.path == "/health":
+            self._send_json(200, {"status": "ok"})
+        elif url.path == "/stats":
+            self._send_json(200, self.service.stats())
+        elif url.path == "/metrics":
+            # Время этапов по сайтам: для Prometheus или JSON (?format=json)
+            if params.get("format", [""])[0] == "json":
+                self._send_json(200, get_metrics().snapshot())
+            else:
+                self._send_text(200, get_metrics().prometheus(), "text/plain; version=0.0.4; charset=utf-8")
+        elif url.path == "/valuate":
+            self._valuate(params)
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def _valuate(self, params):
+        try:
+            make = params["make"][0]
+            model = params["model"][0]
+            year = parse_year(" ".join(params.get("year", [])))
+            limit = int(params.get("limit", ["100"])[0])
+        except (KeyError, ValueError):
+            self._send_json(400, {"error": "нужны параметры make, model, year (2020 или 2019-2021) и limit"})
+            return
+        error = validate_limit(limit)
+        if error:
+            self._send_json(400, {"error": error})
+            return
+
+        future = self.service.submit(make, model, year, limit)
+        try:
+            self._send_json(200, future.result(timeout=self.timeout_sec))
+        except Exception as e:
+            logging.error(f"Ошибка оценки {make} {model} {year}: {e}")
+            self._send_json(500, {"error": str(e)})
+
+    def log_message(self, format, *args):
+        logging.info(f"{self.address_string()} {format % args}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP-сервис оценки залоговой стоимости")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=2, help="Сколько парсингов выполнять одновременно")
+    parser.add_argument("--cache-ttl", type=int, default=3600, help="Время жизни страниц в кэше, сек")
+    parser.add_argument("--no-proxy", action="store_true", help="Работать с собственного IP")
+    parser.add_argument("--full-load", action="store_true", help="Загружать страницы без блокировки ресурсов")
+    parser.add_argument("--engine", choices=sorted(ENGINES), default=DEFAULT_ENGINE,
+                        help="Движок разбора страниц (state — встроенное состояние, пока экспериментально)")
+    parser.add_argument("--http2", action="store_true", help="HTTP-запросы через HTTP/2 (нужны пакеты httpx и h2)")
+    parser.add_argument("--record", help="Записывать загруженные страницы в архив (папка) для воспроизведения")
+    parser.add_argument("--replay", help="Загружать страницы с сервера воспроизведения (bench/replay_server.py)")
+    parser.add_argument("--log-json", action="store_true", help="Журнал в logs/ в формате JSONL")
+    parser.add_argument("--log-level", default="DEBUG", choices=["DEBUG", "INFO", "WARNING", "ERROR"])
+    args = parser.parse_args()
+    setup_logging(structured=args.log_json, level=args.log_level)
+
+    # Прогреваем всё, что переиспользуется между запросами
+    get_page_cache().ttl = args.cache_ttl
+    get_session_manager().http2 = args.http2
+    set_default_engine(args.engine)
+    if args.record:
+        get_recorder().start(args.record)
+    set_replay_base(args.replay)
+    use_proxy = not args.no_proxy and not args.replay  # Сервер воспроизведения локальный — без прокси
+    if use_proxy:
+        get_proxy_pool().start()
+    driver_pool = get_driver_pool()
+    # По два браузера (две страницы одновременно) на auto.ru и drom.ru каждого парсинга
+    driver_pool.size = args.workers * 4
+    driver_pool.use_proxy = use_proxy
+    driver_pool.lean = not args.full_load
+    driver_pool.start()
+
+    ServiceHandler.service = ValuationService(workers=args.workers, use_proxy=use_proxy)
+    server = ThreadingHTTPServer((args.host, args.port), ServiceHandler)
+    logging.info(f"Сервис оценки запущен на http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        ServiceHandler.service.shutdown()
+        driver_pool.shutdown()
+
+
+if __name__ == "__main__":
+    main()
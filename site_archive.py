@@ -0,0 +1,142 @@
+import json
+import logging
+import os
+import threading
+import time
+import urllib.parse
+import zlib
+
+from page_cache import fingerprint, normalize_url
+
+# Заголовки, которые не имеет смысла сохранять и отдавать при воспроизведении
+SKIP_HEADERS = {"content-encoding", "content-length", "transfer-encoding", "connection", "keep-alive", "set-cookie",
+                "date", "server"}
+
+
+class SiteArchive:
+    """
+    Архив загруженных страниц для офлайн-воспроизведения (bench/replay_server.py).
+    index.jsonl — по строке на загрузку: URL, статус, заголовки, время ответа, способ загрузки
+    (requests / selenium / cache) и отпечаток содержимого; само содержимое — pages/<отпечаток>.z (zlib).
+    """
+
+    def __init__(self, archive_dir):
+        self.archive_dir = archive_dir
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(archive_dir, "pages"), exist_ok=True)
+
+    @property
+    def index_path(self):
+        return os.path.join(self.archive_dir, "index.jsonl")
+
+    def _blob_path(self, page_fingerprint):
+        return os.path.join(self.archive_dir, "pages", f"{page_fingerprint}.z")
+
+    def record(self, url, status, headers, body, elapsed, via):
+        page_fingerprint = fingerprint(body or "")
+        entry = {
+            "url": normalize_url(url),
+            "status": status,
+            "headers": {name: value for name, value in (headers or {}).items() if name.lower() not in SKIP_HEADERS},
+            "elapsed": round(elapsed, 4) if elapsed is not None else None,
+            "via": via,
+            "fetched_at": time.time(),
+            "fingerprint": page_fingerprint,
+            "size": len(body or ""),
+        }
+        with self._lock:
+            blob_path = self._blob_path(page_fingerprint)
+            if not os.path.exists(blob_path):
+                with open(blob_path, "wb") as f:
+                    f.write(zlib.compress((body or "").encode("utf-8"), 6))
+            with open(self.index_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def load(self):
+        """{нормализованный URL: последняя успешная запись}"""
+        entries = {}
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    if entry.get("status") == 200 and entry.get("size"):
+                        entries[entry["url"]] = entry
+        except OSError:
+            pass
+        return entries
+
+    def body(self, entry):
+        with open(self._blob_path(entry["fingerprint"]), "rb") as f:
+            return zlib.decompress(f.read()).decode("utf-8")
+
+
+class Recorder:
+    """
+    Запись всех страниц, загруженных safe_request / selenium_request / selenium_request_drom
+    или взятых ими из кэша, в архив (start(archive_dir)); без архива ничего не делает.
+    """
+
+    def __init__(self):
+        self.archive = None
+        self.recorded = 0
+
+    def start(self, archive_dir):
+        self.archive = SiteArchive(archive_dir)
+        logging.info(f"Загруженные страницы записываются в архив {archive_dir}")
+
+    def record(self, url, status, headers, body, elapsed, via):
+        if self.archive is None:
+            return
+        try:
+            self.archive.record(url, status, headers, body, elapsed, via)
+            self.recorded += 1
+        except OSError as e:
+            logging.warning(f"Не удалось записать страницу {url} в архив: {e}")
+
+
+_recorder = None
+_recorder_lock = threading.Lock()
+
+
+def get_recorder():
+    """Общая на процесс запись страниц в архив"""
+    global _recorder
+    with _recorder_lock:
+        if _recorder is None:
+            _recorder = Recorder()
+        return _recorder
+
+
+_replay_base = None  # Адрес сервера воспроизведения (bench/replay_server.py) или None
+
+
+def set_replay_base(base_url):
+    """Все загрузки страниц идут на сервер воспроизведения вместо сайтов (None — на сайты)"""
+    global _replay_base
+    _replay_base = base_url.rstrip("/") if base_url else None
+    if _replay_base:
+        logging.info(f"Страницы загружаются с сервера воспроизведения {_replay_base}")
+
+
+def replaying():
+    """Идёт воспроизведение: страницы грузятся с локального сервера, прокси не нужны"""
+    return _replay_base is not None
+
+
+def replay_url(url):
+    """https://auto.ru/cars/... -> <сервер>/auto.ru/cars/... при воспроизведении, иначе url без изменений"""
+    if _replay_base is None:
+        return url
+    base, parts = urllib.parse.urlsplit(_replay_base), urllib.parse.urlsplit(url)
+    return urllib.parse.urlunsplit((base.scheme, base.netloc, f"{base.path}/{parts.netloc}{parts.path or '/'}",
+                                    parts.query, ""))
+
+
+def original_url(path):
+    """Обратное к replay_url: /auto.ru/cars/...?page=2 -> https://auto.ru/cars/...?page=2"""
+    parts = urllib.parse.urlsplit(path)
+    host, _, rest = parts.path.lstrip("/").partition("/")
+    return urllib.parse.urlunsplit(("https", host, "/" + rest, parts.query, ""))
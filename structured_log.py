@@ -0,0 +1,104 @@
+import contextvars
+import itertools
+import json
+import logging
+import threading
+import traceback
+import uuid
+from datetime import datetime
+from logging.handlers import QueueHandler
+
+RUN_ID = uuid.uuid4().hex[:8]  # Идентификатор запуска процесса — во всех событиях журнала
+
+# Идентификатор оценки (run_query): переносится в потоки парсеров через contextvars.copy_context()
+_query_id = contextvars.ContextVar("query_id", default=None)
+
+# Сколько событий категории пропускать на одно записанное (1 — писать все)
+SAMPLE_EVERY = {"listing": 20}
+
+
+def new_query_id():
+    """Задаёт новый идентификатор оценки для текущего контекста и возвращает его"""
+    query_id = uuid.uuid4().hex[:8]
+    _query_id.set(query_id)
+    return query_id
+
+
+def current_query_id():
+    return _query_id.get()
+
+
+class Sampler:
+    """Прореживание частых событий по категориям: пишется каждое SAMPLE_EVERY[категория]-е"""
+
+    def __init__(self, every=None):
+        self.every = dict(SAMPLE_EVERY if every is None else every)
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, category):
+        """True — событие категории нужно записать"""
+        every = self.every.get(category, 1)
+        if every <= 1:
+            return True
+        with self._lock:
+            counter = self._counters.get(category)
+            if counter is None:
+                counter = self._counters[category] = itertools.count()
+        return next(counter) % every == 0
+
+
+sampled = Sampler()
+
+
+class ContextFilter(logging.Filter):
+    """Добавляет к записи run_id и query_id"""
+
+    def filter(self, record):
+        record.run_id = RUN_ID
+        record.query_id = _query_id.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Запись журнала — одна строка JSON: время, уровень, логгер, поток, сообщение, run_id, query_id,
+    категория события (extra={"event": ...}) и поля события (extra={"fields": {...}}).
+    """
+
+    def format(self, record):
+        event = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "run_id": getattr(record, "run_id", RUN_ID),
+            "query_id": getattr(record, "query_id", None),
+            "msg": record.getMessage(),
+        }
+        category = getattr(record, "event", None)
+        if category:
+            event["event"] = category
+            every = sampled.every.get(category, 1)
+            if every > 1:
+                event["sample_every"] = every
+        fields = getattr(record, "fields", None)
+        if fields:
+            event.update(fields)
+        if record.exc_text or record.exc_info:
+            event["exc"] = record.exc_text or "".join(traceback.format_exception(*record.exc_info))
+        return json.dumps(event, ensure_ascii=False, default=str)
+
+
+class LazyQueueHandler(QueueHandler):
+    """
+    QueueHandler без форматирования в вызывающем потоке: сообщение собирается из msg и args
+    уже в фоновом потоке записи. Очередь внутри процесса, поэтому запись не копируется.
+    """
+
+    def prepare(self, record):
+        if record.exc_info:
+            # Трассировку превращаем в текст сразу: кадры стека не должны жить в очереди
+            record.exc_text = "".join(traceback.format_exception(*record.exc_info)).rstrip("\n")
+            record.exc_info = None
+        return record
@@ -1,81 +1,29 @@
+import atexit
 import os
 import logging
+import queue
 import random
-import requests
 import time
 from datetime import datetime
+from logging.handlers import QueueListener, RotatingFileHandler
 from requests.exceptions import RequestException
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.chrome.options import Options
-from webdriver_manager.chrome import ChromeDriverManager
-
-
-def is_proxy_working(proxy_url, test_url="http://httpbin.org/ip", timeout=5):
-    """Проверяет работоспособность одного прокси"""
-    try:
-        proxies = {"http": proxy_url, "https": proxy_url}
-        response = requests.get(test_url, proxies=proxies, timeout=timeout)
-        return response.status_code == 200
-    except Exception:
-        return False
+from driver_pool import get_driver_pool
+from http_sessions import get_session_manager
+from metrics import get_metrics, site_of
+from page_cache import CachedResponse, get_page_cache
+from proxy_pool import PROXY_FILE, get_proxy_pool, is_proxy_working, proxy_to_url
+from rate_limiter import get_rate_limiter, looks_like_captcha, retry_after_seconds
+from site_archive import get_recorder, replay_url, replaying
+from structured_log import ContextFilter, JsonFormatter, LazyQueueHandler
 
 
 def get_working_proxy(max_attempts=9):
     """
-    Пытается найти рабочий прокси за указанное число попыток
-    возвращает прокси в формате "ip:port@login:password" или None
+    Возвращает лучший рабочий прокси из общего пула в формате "ip:port@login:password" или None.
+    Параметр max_attempts оставлен для совместимости: проверка прокси выполняется пулом в фоне.
     """
-    logging.info("Начало проверки прокси...")
-    try:
-        # Загрузка прокси из файла с логированием
-        try:
-            with open(PROXY_FILE, "r") as f:
-                proxies = [line.strip() for line in f if line.strip()]
-                logging.info(f"Прокси загружены из файла: {len(proxies)} шт.")
-
-            if proxies:
-                logging.info(f"Загружено {len(proxies)} прокси из файла {PROXY_FILE}")
-                logging.info("Проверка прокси завершена.")
-            else:
-                logging.warning(f"Файл {PROXY_FILE} пуст — работа будет вестись с собственным IP")
-                return None
-        except FileNotFoundError:
-            logging.warning(f"Файл {PROXY_FILE} не найден — работа будет вестись с собственным IP")
-            return None
-
-        # Поиск рабочего прокси
-        for attempt in range(1, max_attempts + 1):
-            proxy = random.choice(proxies)
-            try:
-                host_port, auth = proxy.split('@')
-                username, password = auth.split(':')
-                proxy_url = f"http://{username}:{password}@{host_port}"
-
-                logging.info(f"Попытка {attempt}/{max_attempts}: проверка прокси {host_port}")
-
-                if is_proxy_working(proxy_url):
-                    logging.info(f"Найден рабочий прокси: {host_port}")
-                    return proxy
-                else:
-                    logging.warning(f"Прокси {host_port} не отвечает")
-
-            except Exception as e:
-                logging.warning(f"Ошибка проверки прокси: {str(e)}")
-                continue
-
-        logging.warning(f"Не удалось найти рабочий прокси после {max_attempts} попыток")
-        return None
-
-    except Exception as e:
-        logging.error(f"Критическая ошибка в get_working_proxy: {str(e)}")
-        return None
+    return get_proxy_pool().get()
 
-# Файл с прокси
-PROXY_FILE = "proxies.txt"
 
 USER_AGENTS = [
     "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
@@ -102,15 +50,26 @@ def safe_request(url, headers=None, timeout=10, use_proxy=True, retries=3, use_o
 
     logging.info(f"Начало safe_request: {url}")
 
-    session = requests.Session()  # Сохраняет cookies между запросами
+    cache = get_page_cache()
+    recorder = get_recorder()
+    html = cache.get(url)
+    if html is not None:
+        recorder.record(url, 200, None, html, None, "cache")  # Архив записи полон и при прогретом кэше
+        return CachedResponse(url, html)
+    if replaying():
+        use_proxy = False  # Сервер воспроизведения локальный: запрос через удалённый прокси до него не дойдёт
+
+    sessions = get_session_manager()  # Keep-alive сессии с cookies по (прокси, сайту)
+    pool = get_proxy_pool()
+    limiter = get_rate_limiter()
+    metrics = get_metrics()
+    site = site_of(url)
     proxy_used = False
     last_exception = None
 
     for attempt in range(1, retries + 1):
+        proxy = None
         try:
-            # Задержка перед запросом для имитации реального пользователя
-            time.sleep(random.uniform(3, 6))
-
             # Заголовки запроса
             headers = {
                 "User-Agent": random.choice(USER_AGENTS),
@@ -122,38 +81,48 @@ def safe_request(url, headers=None, timeout=10, use_proxy=True, retries=3, use_o
                 "Upgrade-Insecure-Requests": "1",
             }
 
-            proxies = None
+            proxy_url = None
             if use_own_ip:
                 logging.info("Используется собственный IP.")
             elif use_proxy:
-                proxy = get_working_proxy()
+                with metrics.timer("proxy_select", site):
+                    proxy = pool.get()
                 if proxy:
                     try:
-                        host_port, auth = proxy.split('@')
-                        username, password = auth.split(':')
-                        proxy_url = f"http://{username}:{password}@{host_port}"
-                        proxies = {"http": proxy_url, "https": proxy_url}
-                        logging.info(f"Попытка {attempt}/{retries} — используется прокси: {host_port}")
+                        proxy_url = proxy_to_url(proxy)
+                        logging.info(f"Попытка {attempt}/{retries} — используется прокси: {proxy.split('@')[0]}")
                         proxy_used = True
                     except Exception as e:
                         logging.warning(f"Ошибка разбора прокси {proxy}: {e}")
-                        proxies = None
-
-            response = session.get(url, headers=headers, proxies=proxies, timeout=timeout)
-
-            if response.status_code == 429:
-                logging.warning(f"Попытка {attempt}/{retries}: 429 Too Many Requests — ждём и повторяем...")
-                time.sleep(random.uniform(30, 60))
+                        proxy_url = None
+                        proxy = None
+
+            # Паузу между запросами задаёт общий ограничитель частоты для сайта и выхода
+            limiter.acquire(url, proxy)
+            with metrics.timer("http_get", site):
+                response = sessions.get(replay_url(url), proxy_url, headers=headers, timeout=timeout)
+            recorder.record(url, response.status_code, response.headers, response.text,
+                            response.elapsed.total_seconds(), "requests")
+
+            if response.status_code == 429 or (response.status_code == 403 and looks_like_captcha(response.url, response.text)):
+                logging.warning(f"Попытка {attempt}/{retries}: {response.status_code} — сайт ограничил запросы, повторяем позже")
+                # Прокси рабочий: ограничение сайта учитывает ограничитель частоты, а не пул прокси
+                limiter.throttle(url, proxy, retry_after_seconds(response), reason=str(response.status_code))
                 continue
 
             response.raise_for_status()
+            limiter.success(url, proxy, response.elapsed.total_seconds())
+            pool.report_success(proxy, response.elapsed.total_seconds())
+            cache.put(url, response.text)
             logging.info(f"Успешный запрос к {url} за {response.elapsed.total_seconds():.2f} сек.")
             return response
 
         except RequestException as e:
             last_exception = e
+            pool.report_failure(proxy)
             logging.warning(f"Попытка {attempt}/{retries} не удалась: {e}")
-            time.sleep(2 ** attempt)
+            with metrics.timer("retry_sleep", site):
+                time.sleep(2 ** attempt)
 
     # После всех попыток
     logging.error(f"Не удалось получить {url} после {retries} попыток. Последняя ошибка: {last_exception}")
@@ -166,57 +135,60 @@ def safe_request(url, headers=None, timeout=10, use_proxy=True, retries=3, use_o
 
 
 
+def _report_browser_failure(limiter, driver, url, proxy):
+    """
+    Неудачная загрузка в браузере: если это капча — сайт ограничил выход, снижаем частоту.
+    Возвращает True для капчи: прокси при этом рабочий и в отказы прокси не записывается.
+    """
+    try:
+        current_url, page_head = driver.current_url, driver.page_source[:5000]
+    except Exception:
+        return False
+    if looks_like_captcha(current_url, page_head):
+        limiter.throttle(url, proxy, reason="капча")
+        return True
+    return False
+
+
 def selenium_request(url, driver, use_proxy=True, retries=3):
     """Загрузка HTML-страницы через Selenium для Auto.ru"""
+    from selenium.webdriver.common.by import By  # selenium загружается, только когда нужен браузер
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+    cache = get_page_cache()
+    recorder = get_recorder()
+    html = cache.get(url)
+    if html is not None:
+        recorder.record(url, 200, None, html, None, "cache")  # Архив записи полон и при прогретом кэше
+        return html, driver, True
+    if replaying():
+        use_proxy = False  # Браузер с прокси не дойдёт до локального сервера воспроизведения
+
+    proxy_pool = get_proxy_pool()
+    driver_pool = get_driver_pool()
+    limiter = get_rate_limiter()
+    metrics = get_metrics()
+    site = site_of(url)
+    proxy = None
     for attempt in range(retries + 1):
         try:
-            proxy = get_working_proxy() if use_proxy else None
-
+            # Браузер берём из пула прогретых драйверов, прокси задаётся при его запуске
+            if not driver:
+                with metrics.timer("driver_acquire", site):
+                    driver = driver_pool.acquire(use_proxy=use_proxy)
+            proxy = driver_pool.proxy_for(driver)
             if proxy:
-                try:
-                    # Разбиваем строку прокси на части: host:port@login:password
-                    proxy_parts = proxy.split('@')
-                    host_port = proxy_parts[0]
-                    auth_part = proxy_parts[1]
-                    username, password = auth_part.split(':')
-
-                    # Формируем URL прокси с логином и паролем
-                    proxy_url = f"http://{username}:{password}@{host_port}"
-
-                    # Настройка прокси в ChromeOptions
-                    options = Options()
-                    options.add_argument("--headless")
-                    options.add_argument("--ignore-certificate-errors")
-                    options.add_argument("--disable-blink-features=AutomationControlled")
-                    options.add_argument("--disable-features=SecureDns")
-                    options.add_argument(
-                        "--user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
-                    )
-                    options.add_argument(f"--proxy-server={proxy_url}")
-
-                    logging.info(f"Используется прокси: {proxy_url}")
-                except Exception as e:
-                    logging.error(f"Ошибка парсинга прокси {proxy}: {str(e)}")
-                    proxy = None  # Пропускаем этот прокси
+                logging.info(f"Используется прокси: {proxy.split('@')[0]}")
             else:
-                logging.info("Используется собственный IP.") # после 3 не удачных попыток
-                options = Options()
-                options.add_argument("--headless")
-                options.add_argument("--ignore-certificate-errors")
-                options.add_argument("--disable-blink-features=AutomationControlled")
-                options.add_argument("--disable-features=SecureDns")
-                options.add_argument(
-                    "--user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
-                )
-
-            # Инициализация драйвера с текущими настройками
-            if not driver:
-                driver = webdriver.Chrome(
-                    service=Service(ChromeDriverManager().install()), options=options
-                )
+                logging.info("Используется собственный IP.")
 
+            driver_pool.prepare_page(driver)
+            limiter.acquire(url, proxy)  # Пауза между страницами — по частоте, которую терпит сайт
             start_time = time.time()
-            driver.get(url)
+            with metrics.timer("driver_get", site):
+                driver.get(replay_url(url))  # При воспроизведении — с локального сервера
+                driver_pool.finish_load(driver)
+            driver_pool.note_page(driver)
 
             # Проверка на SSO-страницу
             if "sso.auto.ru" in driver.current_url:
@@ -224,129 +196,173 @@ def selenium_request(url, driver, use_proxy=True, retries=3):
                 time.sleep(2)  # Ждём редирект
 
             # Ожидание загрузки объявлений
-            WebDriverWait(driver, 15).until(
-                EC.presence_of_element_located((By.CLASS_NAME, "ListingItem"))
-            )
+            with metrics.timer("dom_wait", site):
+                WebDriverWait(driver, 15).until(
+                    EC.presence_of_element_located((By.CLASS_NAME, "ListingItem"))
+                )
             elapsed_time = time.time() - start_time
+            proxy_pool.report_success(proxy, elapsed_time)
+            limiter.success(url, proxy, elapsed_time)
             logging.info(f"Запрос к {url} выполнен за {elapsed_time:.2f} сек.")
 
-            return driver.page_source, driver, True  # Возвращаем True, если запрос успешен
+            with metrics.timer("page_source", site):
+                html = driver.page_source
+            driver_pool.record_page(driver, url, elapsed_time)
+            recorder.record(url, 200, None, html, elapsed_time, "selenium")
+            cache.put(url, html)
+            return html, driver, True  # Возвращаем True, если запрос успешен
         except Exception as e:
+            # Капча — ограничение сайта, а не отказ прокси: её учитывает только ограничитель частоты
+            if not (driver and _report_browser_failure(limiter, driver, url, proxy)):
+                proxy_pool.report_failure(proxy)
             if attempt < retries:
                 logging.warning(
                     f"Попытка {attempt + 1}/{retries} для {url} через {proxy or 'собственный IP'}: {e}"
                 )
                 # Экспоненциальная задержка (1, 2, 4 секунды между попытками)
                 delay = 2 ** attempt
-                time.sleep(delay)
+                with metrics.timer("retry_sleep", site):
+                    time.sleep(delay)
             else:
                 logging.error(
                     f"Не удалось выполнить запрос к {url} после {retries} попыток: {str(e)}"
                 )
                 if proxy:
                     logging.info("Переходим к использованию собственного IP.")
+                    driver_pool.release(driver, broken=True, use_proxy=False)  # Замена — сразу для своего IP
                     return selenium_request(url, None, use_proxy=False, retries=retries)
-                return "", None, False  # Возвращаем False, если запрос неуспешен
-    return "", None, False  # Возвращаем False, если запрос неуспешен
+                return "", driver, False  # Возвращаем False, драйвер вызывающий код вернёт в пул
+    return "", driver, False  # Возвращаем False, если запрос неуспешен
 
 
 def selenium_request_drom(url, driver, use_proxy=True, retries=3):
     """Загрузка HTML-страницы через Selenium для Drom.ru"""
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+    cache = get_page_cache()
+    recorder = get_recorder()
+    html = cache.get(url)
+    if html is not None:
+        recorder.record(url, 200, None, html, None, "cache")  # Архив записи полон и при прогретом кэше
+        return html, driver, True
+    if replaying():
+        use_proxy = False  # Браузер с прокси не дойдёт до локального сервера воспроизведения
+
+    proxy_pool = get_proxy_pool()
+    driver_pool = get_driver_pool()
+    limiter = get_rate_limiter()
+    metrics = get_metrics()
+    site = site_of(url)
+    proxy = None
     for attempt in range(retries + 1):
         try:
-            proxy = get_working_proxy() if use_proxy else None
-
+            # Браузер берём из пула прогретых драйверов, прокси задаётся при его запуске
+            if not driver:
+                with metrics.timer("driver_acquire", site):
+                    driver = driver_pool.acquire(use_proxy=use_proxy)
+            proxy = driver_pool.proxy_for(driver)
             if proxy:
-                try:
-                    # Разбиваем строку прокси на части: host:port@login:password
-                    proxy_parts = proxy.split('@')
-                    host_port = proxy_parts[0]
-                    auth_part = proxy_parts[1]
-                    username, password = auth_part.split(':')
-
-                    # Формируем URL прокси с логином и паролем
-                    proxy_url = f"http://{username}:{password}@{host_port}"
-
-                    # Настройка прокси в ChromeOptions
-                    options = webdriver.ChromeOptions()
-                    options.add_argument("--headless")
-                    options.add_argument("--ignore-certificate-errors")
-                    options.add_argument("--disable-blink-features=AutomationControlled")
-                    options.add_argument("--disable-features=SecureDns")
-                    options.add_argument(
-                        "--user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
-                    )
-                    options.add_argument(f"--proxy-server={proxy_url}")
-
-                    logging.info(f"Используется прокси: {proxy_url}")
-                except Exception as e:
-                    logging.error(f"Ошибка парсинга прокси {proxy}: {str(e)}")
-                    proxy = None  # Пропускаем этот прокси
+                logging.info(f"Используется прокси: {proxy.split('@')[0]}")
             else:
-                logging.info("Используется собственный IP.") # после 3 не удачных попыток
-                options = webdriver.ChromeOptions()
-                options.add_argument("--headless")
-                options.add_argument("--ignore-certificate-errors")
-                options.add_argument("--disable-blink-features=AutomationControlled")
-                options.add_argument("--disable-features=SecureDns")
-                options.add_argument(
-                    "--user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
-                )
-
-            # Инициализация драйвера с текущими настройками
-            if not driver:
-                driver = webdriver.Chrome(
-                    service=Service(ChromeDriverManager().install()), options=options
-                )
+                logging.info("Используется собственный IP.")
 
+            driver_pool.prepare_page(driver)
+            limiter.acquire(url, proxy)  # Пауза между страницами — по частоте, которую терпит сайт
             start_time = time.time()
-            driver.get(url)
+            with metrics.timer("driver_get", site):
+                driver.get(replay_url(url))  # При воспроизведении — с локального сервера
+                driver_pool.finish_load(driver)
+            driver_pool.note_page(driver)
 
             # Ожидание загрузки объявлений
-            WebDriverWait(driver, 15).until(
-                EC.presence_of_element_located((By.CSS_SELECTOR, "[data-ftid='bulls-list_bull']"))
-            )
-            logging.info(f"Запрос к {url} занял {time.time()-start_time:.3f} сек")
-
-            #elapsed_time = time.time() - start_time
-            #logging.info(f"Запрос к {url} выполнен за {elapsed_time:.2f} сек.")
-
-            return driver.page_source, driver, True  # Возвращаем True, если запрос успешен
+            with metrics.timer("dom_wait", site):
+                WebDriverWait(driver, 15).until(
+                    EC.presence_of_element_located((By.CSS_SELECTOR, "[data-ftid='bulls-list_bull']"))
+                )
+            elapsed_time = time.time() - start_time
+            proxy_pool.report_success(proxy, elapsed_time)
+            limiter.success(url, proxy, elapsed_time)
+            logging.info(f"Запрос к {url} занял {elapsed_time:.3f} сек")
+
+            with metrics.timer("page_source", site):
+                html = driver.page_source
+            driver_pool.record_page(driver, url, elapsed_time)
+            recorder.record(url, 200, None, html, elapsed_time, "selenium")
+            cache.put(url, html)
+            return html, driver, True  # Возвращаем True, если запрос успешен
         except Exception as e:
+            # Капча — ограничение сайта, а не отказ прокси: её учитывает только ограничитель частоты
+            if not (driver and _report_browser_failure(limiter, driver, url, proxy)):
+                proxy_pool.report_failure(proxy)
             if attempt < retries:
                 logging.warning(
                     f"Попытка {attempt + 1}/{retries} для {url} через {proxy or 'собственный IP'}: {e}"
                 )
                 # Экспоненциальная задержка (1, 2, 4 секунды между попытками)
                 delay = 2 ** attempt
-                time.sleep(delay)
+                with metrics.timer("retry_sleep", site):
+                    time.sleep(delay)
             else:
                 logging.error(
                     f"Не удалось выполнить запрос к {url} после {retries} попыток: {str(e)}"
                 )
                 if proxy:
                     logging.info("Переходим к использованию собственного IP.")
-                    return selenium_request_drom(url, driver, use_proxy=False, retries=retries)
-                return "", None, False  # Возвращаем False, если запрос неуспешен
-    return "", None, False  # Возвращаем False, если запрос неуспешен
+                    driver_pool.release(driver, broken=True, use_proxy=False)  # Замена — сразу для своего IP
+                    return selenium_request_drom(url, None, use_proxy=False, retries=retries)
+                return "", driver, False  # Возвращаем False, драйвер вызывающий код вернёт в пул
+    return "", driver, False  # Возвращаем False, если запрос неуспешен
+
+
+LOG_FORMAT = "%(asctime)s [%(levelname)s] %(name)s: %(message)s"
+
+_log_listener = None
+
+
+def stop_logging():
+    """Дописывает очередь журнала и закрывает файлы (вызывается и при выходе из процесса)"""
+    global _log_listener
+    if _log_listener is not None:
+        _log_listener.stop()
+        for handler in _log_listener.handlers:
+            handler.close()
+        _log_listener = None
+
 
 # Настройка логирования
-def setup_logging():
+def setup_logging(structured=False, level=logging.DEBUG, max_bytes=50 * 1024 * 1024, backup_count=5):
+    """
+    Журнал в logs/ (с ротацией по max_bytes) и в консоль. Записи уходят в очередь и пишутся
+    фоновым потоком: потоки парсеров не ждут диск и консоль, сообщения форматируются там же.
+    structured=True — файл в формате JSONL (события с run_id и query_id), в консоли — от INFO.
+    """
     log_dir = "logs"
     if not os.path.exists(log_dir):  # Создаём папку, если её нет
         os.makedirs(log_dir)
-    log_filename = os.path.join(log_dir, f"parser_log_{datetime.now().strftime('%Y-%m-%d__%H-%M')}.log")
+    extension = "jsonl" if structured else "log"
+    log_filename = os.path.join(log_dir, f"parser_log_{datetime.now().strftime('%Y-%m-%d__%H-%M')}.{extension}")
+    file_handler = RotatingFileHandler(log_filename, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+    file_handler.setFormatter(JsonFormatter() if structured else logging.Formatter(LOG_FORMAT))
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    if structured:
+        console_handler.setLevel(logging.INFO)
+
+    global _log_listener
+    stop_logging()
+    _log_listener = QueueListener(queue.SimpleQueue(), file_handler, console_handler, respect_handler_level=True)
+    queue_handler = LazyQueueHandler(_log_listener.queue)
+    queue_handler.addFilter(ContextFilter())  # run_id и query_id берутся в потоке, который пишет запись
     logging.basicConfig(
-        level=logging.DEBUG,
-        format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
-        handlers=[
-            logging.FileHandler(log_filename, encoding="utf-8"),
-            logging.StreamHandler()
-        ],
+        level=level,
+        handlers=[queue_handler],
         force=True  # Принудительное обновление конфигурации
     )
+    _log_listener.start()
     logging.getLogger("selenium.webdriver.remote.remote_connection").setLevel(logging.WARNING)
     logging.getLogger("urllib3").setLevel(logging.WARNING)
     logging.info("Логирование настроено успешно!")  # Проверка, записывается ли лог
 
 
+atexit.register(stop_logging)